@@ -4,9 +4,16 @@ import webbrowser
 import combiner
 import scheduler
 import subject_parser
+import renderer
+import metrics
+import session
 from typing import List
 from CTkTable import CTkTable
 import subprocess, os, platform
+import multiprocessing
+import threading
+import re
+from datetime import time
 
 # File opening protocol
 if platform.system() == 'Darwin':       # macOS
@@ -30,6 +37,15 @@ DEL_ICON_PATH = r'./assets/images/delete_icon.png'
 REP_URL = r'https://github.com/gonzagrau/Combinador-PSICO-UBA'
 CAMPUS_URL = r'http://academica.psi.uba.ar/index.php'
 OUTPUT_PATH = r"combinations.xlsx"
+SESSION_PATH = r"session.json"
+SESSION_RESULTS_PATH = r"session.comb"
+GALLERY_PAGE_SIZE = 24
+GALLERY_COLUMNS = 6
+THUMBNAIL_SIZE = (180, 150)
+EXPORT_POLL_MS = 200
+# above this amount of combinations, only a uniform random sample of SAMPLE_SIZE is shown
+MAX_DISPLAYED_COMBINATIONS = 2000
+SAMPLE_SIZE = 10*GALLERY_PAGE_SIZE
 
 # STRING CONSTANTS
 LINK_ENTRY_TEXT = 'Ingrese el link de la materia a agregar'
@@ -46,10 +62,46 @@ COMBINE_BUTTON_TEXT = 'Calcular combinaciones'
 SEL_ALL_TEXT = 'Seleccionar todas'
 DESEL_ALL_TEXT = 'Deseleccionar todas'
 LAUNCH_TEXT = 'Ver horarios completos en Excel'
+EXPORTING_TEXT = 'Exportando a Excel... {done}/{total}'
+EXPORT_ERROR_TEXT = 'Error al exportar a Excel'
+CONSTRAINTS_TEXT = 'Restricciones'
+NOT_BEFORE_TEXT = 'Sin clases antes de (hh:mm)'
+NOT_AFTER_TEXT = 'Sin clases después de (hh:mm)'
+BUSY_TEXT = 'Ocupado (ej: martes 14:00-18:00, jueves 08:00-10:00)'
+MAX_DAYS_TEXT = 'Máx. días'
+NO_LIMIT_TEXT = 'Sin límite'
+EXCLUDE_TEACHER_TEXT = 'Excluir docente'
+PREFER_TEACHER_TEXT = 'Preferir docente'
+CONSTRAINTS_ERROR_TEXT = 'Restricciones inválidas: {error}'
+SORT_TEXT = 'Ordenar por'
+# sorting options of the gallery: label -> (metrics columns, ascending)
+SORT_OPTIONS = {'Orden de búsqueda': (None, True),
+                'Menos días': (['days', 'idle_minutes'], True),
+                'Menos horas libres': (['idle_minutes', 'days'], True),
+                'Empieza más tarde': (['earliest_start'], False),
+                'Termina más temprano': (['latest_finish'], True),
+                'Menos horas por día': (['max_day_hours', 'hours_per_day'], True)}
 
 # Shortcut for fast padding
 padding = dict(padx=5, pady=5)
 
+# times typed by the user: a bare hour (e.g. 9 or 10) or hh:mm
+TIME_INPUT_REGEX = r'(\d{1,2})(?::(\d{2}))?'
+
+
+def parse_time_input(time_str: str) -> time:
+    """
+    :param time_str: user input, either 'h', 'hh', 'h:mm' or 'hh:mm'
+    :return: the corresponding time
+    """
+    match = re.fullmatch(TIME_INPUT_REGEX, time_str.strip())
+    if not match:
+        raise ValueError(f'hora inválida (use hh:mm): {time_str}')
+    hh, mm = int(match.group(1)), int(match.group(2) or 0)
+    if hh >= 24 or mm >= 60:
+        raise ValueError(f'hora inválida (use hh:mm): {time_str}')
+    return time(hh, mm)
+
 
 # Class definitions for UI
 class MainWindow(ctk.CTk):
@@ -66,8 +118,21 @@ class MainWindow(ctk.CTk):
         self.grid_columnconfigure(0, weight=1)
         self.grid_rowconfigure(0, weight=1)
 
+        # Schedule thumbnails renderer, shared by every frame
+        self.renderer = renderer.ScheduleRenderer()
+
+        # Restore the last session, if any, going straight to its results
+        self.session = session.SessionStore(SESSION_PATH, SESSION_RESULTS_PATH)
+        self.subjects, combinations, total = self.session.load()
+        self._save_pending = False
+        self._pending_results = None
+        self._pending_total = None
+
         # Setting properties
-        self.current_frame = MainFrame(self)
+        if combinations is not None and len(combinations):
+            self.current_frame = DisplayCombFrame(self, self.subjects, combinations, total=total)
+        else:
+            self.current_frame = MainFrame(self, self.subjects)
         # self.state('zoomed') # This is not working
 
         # Setting closing protocol
@@ -76,9 +141,27 @@ class MainWindow(ctk.CTk):
     def _quit_me(self):
     # This ensures that the program stops when the main window is closed
         print('quit')
+        if self._save_pending:
+            self._flush_session()
+        self.renderer.close()
         self.quit()
         self.destroy()
 
+    def save_session(self, combinations: combiner.CombinationSet = None, total: int = None):
+        # saves are coalesced until Tk is idle, so that (de)selecting all comissions writes only once.
+        # Any change saved without results discards the previous ones
+        self._pending_results = combinations
+        self._pending_total = total
+        if not self._save_pending:
+            self._save_pending = True
+            self.after_idle(self._flush_session)
+
+    def _flush_session(self):
+        self._save_pending = False
+        self.session.save(self.subjects, self._pending_results, self._pending_total)
+        self._pending_results = None
+        self._pending_total = None
+
     @property
     def current_frame(self):
         return self._current_frame
@@ -257,7 +340,11 @@ class MainFrame(ctk.CTkFrame):
         # html parse
         new_url = self.link_entry.get()
         new_sub = subject_parser.url_parse(new_url)
+        # comissions start deselected, the user picks them in the selector
+        for comission in new_sub.comission_list:
+            comission.deselect()
         self.subjects_list.append(new_sub)
+        self.master.save_session()
 
         # clear entry and add to table
         self.link_entry.delete(0, len(new_url))
@@ -267,6 +354,7 @@ class MainFrame(ctk.CTkFrame):
         try:
             self.subjects_list.pop()
             self.subjects_table.delete_row(len(self.subjects_list)+1)
+            self.master.save_session()
         except IndexError:
             pass
 
@@ -308,6 +396,10 @@ class CombinerFrame(ctk.CTkFrame):
             self.add_selector(subject)
         self.selector_frame.pack(fill=ctk.BOTH, side=ctk.TOP, expand=True, **padding)
 
+        # Constraints
+        self.constraints_frame = ConstraintsFrame(self)
+        self.constraints_frame.pack(fill=ctk.X, side=ctk.TOP, **padding)
+
         # Combine button
         self.combine_button = ctk.CTkButton(master=self,
                                             text=COMBINE_BUTTON_TEXT,
@@ -318,15 +410,103 @@ class CombinerFrame(ctk.CTkFrame):
                                             fg_color=('lightgreen', 'darkgreen'))
         self.combine_button.pack(side=ctk.TOP, pady=25)
 
+        # Invalid input feedback
+        self.error_label = ctk.CTkLabel(master=self, text='', text_color='red')
+        self.error_label.pack(side=ctk.TOP, **padding)
+
     def add_selector(self, subject):
         selector = ComissionSelectorFrame(self.selector_frame, subject)
         selector.pack(expand=True, fill=ctk.BOTH, side=ctk.LEFT, **padding)
         self.selector_list.append(selector)
 
     def combine_action(self):
-        combinations = combiner.find_combinations(self.subjects)
-        scheduler.save_to_excel(self.subjects, combinations, OUTPUT_PATH)
-        self.master.current_frame = DisplayCombFrame(self.master, self.subjects, combinations)
+        try:
+            constraints = self.constraints_frame.get_constraints()
+        except (ValueError, AssertionError) as error:
+            self.error_label.configure(text=CONSTRAINTS_ERROR_TEXT.format(error=error))
+            return
+        self.error_label.configure(text='')
+        table = combiner.CompatibilityTable(self.subjects)
+        total = table.count_combinations(self.subjects, None, constraints)
+        if total > MAX_DISPLAYED_COMBINATIONS:
+            combinations = combiner.sample_combinations(self.subjects, SAMPLE_SIZE, constraints=constraints, table=table)
+        else:
+            combinations = combiner.combine(self.subjects, constraints, table=table)
+        diagnosis = combiner.diagnose(self.subjects, constraints, table) if not total else None
+        self.master.save_session(combinations, total)
+        self.master.current_frame = DisplayCombFrame(self.master, self.subjects, combinations, diagnosis, total)
+
+
+class ConstraintsFrame(ctk.CTkFrame):
+    """
+    This frame holds the inputs for the hard constraints applied while combining:
+    time limits, busy windows, a maximum amount of days and teacher filters
+    """
+    def __init__(self, master, **kwargs):
+        super().__init__(master, **kwargs)
+        self.columnconfigure((1, 2, 3), weight=1)
+
+        self.title_label = ctk.CTkLabel(master=self,
+                                        text=CONSTRAINTS_TEXT,
+                                        font=('helvetica', 15, 'bold'))
+        self.title_label.grid(row=0, column=0, rowspan=2, **padding)
+
+        # row 0: time limits and maximum amount of days
+        self.not_before_entry = ctk.CTkEntry(master=self, placeholder_text=NOT_BEFORE_TEXT)
+        self.not_before_entry.grid(row=0, column=1, sticky='ew', **padding)
+        self.not_after_entry = ctk.CTkEntry(master=self, placeholder_text=NOT_AFTER_TEXT)
+        self.not_after_entry.grid(row=0, column=2, sticky='ew', **padding)
+        self.max_days_var = ctk.StringVar(value=NO_LIMIT_TEXT)
+        self.max_days_menu = ctk.CTkOptionMenu(master=self,
+                                               values=[NO_LIMIT_TEXT] + [f"{MAX_DAYS_TEXT}: {i}" for i in range(1, len(combiner.weekdays_list))],
+                                               variable=self.max_days_var,
+                                               fg_color='purple',
+                                               button_color='purple')
+        self.max_days_menu.grid(row=0, column=3, sticky='ew', **padding)
+
+        # row 1: busy windows and teacher filters
+        self.busy_entry = ctk.CTkEntry(master=self, placeholder_text=BUSY_TEXT)
+        self.busy_entry.grid(row=1, column=1, sticky='ew', **padding)
+        self.exclude_teacher_entry = ctk.CTkEntry(master=self, placeholder_text=EXCLUDE_TEACHER_TEXT)
+        self.exclude_teacher_entry.grid(row=1, column=2, sticky='ew', **padding)
+        self.prefer_teacher_entry = ctk.CTkEntry(master=self, placeholder_text=PREFER_TEACHER_TEXT)
+        self.prefer_teacher_entry.grid(row=1, column=3, sticky='ew', **padding)
+
+    def get_constraints(self) -> combiner.Constraints:
+        max_days = self.max_days_var.get()
+        constraints = combiner.Constraints(None if max_days == NO_LIMIT_TEXT else int(max_days.split(':')[-1]))
+
+        not_before = self.not_before_entry.get().strip()
+        if len(not_before):
+            constraints.block_before(parse_time_input(not_before))
+        not_after = self.not_after_entry.get().strip()
+        if len(not_after):
+            constraints.block_after(parse_time_input(not_after))
+
+        # busy windows are comma separated, in the format <weekday> <hh:mm>-<hh:mm>
+        for window in self.busy_entry.get().split(','):
+            if not len(window.strip()):
+                continue
+            match = re.fullmatch(r'\s*(\w+)\s+(\d{1,2}(?::\d{2})?)\s*-\s*(\d{1,2}(?::\d{2})?)\s*', window)
+            if not match:
+                raise ValueError(f'franja ocupada inválida: {window.strip()}')
+            weekday, start_str, end_str = match.groups()
+            weekday = weekday.upper().replace('É', 'E').replace('Á', 'A')
+            if weekday not in combiner.weekdays_list:
+                raise ValueError(f'día inválido: {match.group(1)}')
+            start, end = parse_time_input(start_str), parse_time_input(end_str)
+            if start >= end:
+                raise ValueError(f'la franja debe empezar antes de terminar: {window.strip()}')
+            constraints.block(weekday, start, end)
+
+        for teacher in self.exclude_teacher_entry.get().split(','):
+            if len(teacher.strip()):
+                constraints.exclude_teacher(teacher)
+        for teacher in self.prefer_teacher_entry.get().split(','):
+            if len(teacher.strip()):
+                constraints.prefer_teacher(teacher)
+
+        return constraints
 
 
 class ComissionSelectorFrame(ctk.CTkScrollableFrame):
@@ -350,7 +530,7 @@ class ComissionSelectorFrame(ctk.CTkScrollableFrame):
         self.row_counter += 1
 
         # select all radio buttons
-        self.radio_var = ctk.BooleanVar(value=False)
+        self.radio_var = ctk.BooleanVar(value=all(com.is_selected() for com in subject.comission_list))
         self.sel_all_radio = ctk.CTkRadioButton(master=self,
                                                 text=SEL_ALL_TEXT,
                                                 variable=self.radio_var,
@@ -373,8 +553,6 @@ class ComissionSelectorFrame(ctk.CTkScrollableFrame):
         for comission in subject.comission_list:
             self.add_comission_checkbox(comission)
 
-        self.desel_radio_action()
-
     def add_comission_checkbox(self, comission):
         # label for each comission
         com_label = ctk.CTkLabel(master=self,
@@ -405,7 +583,7 @@ class ComissionCheckbox(ctk.CTkCheckBox):
     def __init__(self, master, comission: combiner.Comission, **kwargs):
         super().__init__(master, **kwargs)
         self.comission = comission
-        self.check_var = ctk.BooleanVar(value=True)
+        self.check_var = ctk.BooleanVar(value=comission.is_selected())
         self.configure(text=comission.blocks_str(),
                        command=self.toggle_comission,
                        variable=self.check_var,
@@ -415,19 +593,19 @@ class ComissionCheckbox(ctk.CTkCheckBox):
             self.comission.select()
         else:
             self.comission.deselect()
+        self.winfo_toplevel().save_session()
 
 
 class DisplayCombFrame(ctk.CTkScrollableFrame):
-    def __init__(self, master: MainWindow, subjects: List[combiner.Subject], combinations: List[combiner.Combination], **kwargs):
+    def __init__(self, master: MainWindow, subjects: List[combiner.Subject], combinations: List[combiner.Combination],
+                 diagnosis: combiner.Diagnosis = None, total: int = None, **kwargs):
         super().__init__(master, **kwargs)
         self.master = master
         self.subjects = subjects
         self.combinations = combinations
-        self.schedules = []
-        for combination in self.combinations:
-            new_sched = scheduler.Schedule(freq='60T')
-            new_sched.add_combination(self.subjects, combination)
-            self.schedules.append(new_sched)
+        self.diagnosis = diagnosis
+        # total amount of combinations, when only a sample of them is displayed
+        self.total = total
 
         # grid configuration
         self.rowconfigure(0, weight=1)
@@ -450,6 +628,8 @@ class DisplayCombFrame(ctk.CTkScrollableFrame):
         def found_str(l: List):
             if not len(l):
                 return 'Ninguna combinación hallada'
+            elif self.total is not None and self.total > len(l):
+                return f"{self.total} combinaciones halladas (se muestran {len(l)} al azar)"
             elif len(l) == 1:
                 return '1 combinación hallada'
             return f"{len(l)} combinaciones halladas"
@@ -460,16 +640,22 @@ class DisplayCombFrame(ctk.CTkScrollableFrame):
                                              anchor='center')
         self.comb_found_label.grid(row=0, column=1)
 
-        # Schedule tabview
-        self.schedules_tabs = ScheduleTabView(self, self.schedules)
-        self.schedules_tabs.grid(row=1, column=0, columnspan=2, padx=20, pady=20)
+        # Schedule gallery, or why no combination was found
+        if self.diagnosis is not None:
+            self.diagnosis_label = ctk.CTkLabel(master=self,
+                                                text=str(self.diagnosis),
+                                                font=('helvetica', 15),
+                                                justify='left')
+            self.diagnosis_label.grid(row=1, column=0, columnspan=2, padx=20, pady=20)
+        else:
+            self.gallery = ScheduleGalleryFrame(self, self.subjects, self.combinations, self.master.renderer)
+            self.gallery.grid(row=1, column=0, columnspan=2, padx=20, pady=20)
 
-        # launch excel file
-        def launch_action():
-            launch_file(os.path.abspath(OUTPUT_PATH))
+        # launch excel file, exporting it first (in the background) if needed
+        self.export_job = None
         self.launch_button = ctk.CTkButton(master=self,
                                            text=LAUNCH_TEXT,
-                                           command=launch_action,
+                                           command=self.launch_action,
                                            height=35,
                                            font=('roboto', 25, 'bold'),
                                            text_color=('black', 'white'),
@@ -477,10 +663,61 @@ class DisplayCombFrame(ctk.CTkScrollableFrame):
         self.launch_button.grid(row=2, column=0, columnspan=2, padx=20, pady=20)
 
 
+    def launch_action(self):
+        if self.export_job is None or self.export_job.error is not None:
+            self.export_job = ExcelExportJob(self.subjects, self.combinations, OUTPUT_PATH)
+            self.export_job.start()
+            self.poll_export()
+        elif self.export_job.finished:
+            launch_file(os.path.abspath(OUTPUT_PATH))
+
+    def poll_export(self):
+        if not self.winfo_exists():
+            return
+        job = self.export_job
+        if not job.finished:
+            self.launch_button.configure(text=EXPORTING_TEXT.format(done=job.done, total=job.total), state='disabled')
+            self.after(EXPORT_POLL_MS, self.poll_export)
+        elif job.error is not None:
+            self.launch_button.configure(text=EXPORT_ERROR_TEXT, state='normal')
+        else:
+            self.launch_button.configure(text=LAUNCH_TEXT, state='normal')
+            launch_file(os.path.abspath(OUTPUT_PATH))
+
     def go_back_to_combiner(self):
         self.master.current_frame = CombinerFrame(self.master, self.subjects)
 
 
+class ExcelExportJob(object):
+    """
+    Runs scheduler.save_to_excel in a background thread, keeping track of its progress
+    so that the GUI can poll it without blocking
+    """
+    def __init__(self, subjects: List[combiner.Subject], combinations: combiner.CombinationSet, filepath: str):
+        self.subjects = subjects
+        self.combinations = combinations
+        self.filepath = filepath
+        self.done = 0
+        self.total = len(combinations)
+        self.finished = False
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def _update(self, done: int, total: int):
+        self.done = done
+
+    def _run(self):
+        try:
+            scheduler.save_to_excel(self.subjects, self.combinations, self.filepath, progress=self._update)
+        except Exception as error:
+            self.error = error
+        finally:
+            self.finished = True
+
+
 class GoBackButton(ctk.CTkButton):
     def __init__(self, master: DisplayCombFrame | CombinerFrame, **kwargs):
         super().__init__(master, **kwargs)
@@ -525,17 +762,88 @@ class CTkSchedule(CTkTable):
                 self.frame[i, j].configure(fg_color=color)
 
 
-class ScheduleTabView(ctk.CTkTabview):
-    def __init__(self, master, schedules: List[scheduler.Schedule], **kwargs):
+class ScheduleGalleryFrame(ctk.CTkFrame):
+    """
+    This frame shows a page of schedule thumbnails at once, rendered by the window's
+    ScheduleRenderer. Clicking on a thumbnail opens the full schedule
+    """
+    def __init__(self, master, subjects: List[combiner.Subject], combinations: combiner.CombinationSet,
+                 schedule_renderer: renderer.ScheduleRenderer, **kwargs):
         super().__init__(master, **kwargs)
-        self.schedules = schedules
-        for index, schedule in enumerate(schedules):
-            new_name = f"Comb. {index + 1}"
-            self.add(new_name)
-            new_sched = CTkSchedule(master=self.tab(new_name), schedule=schedule)
-            new_sched.grid(row=0, column=0, sticky='nsew')
+        self.subjects = subjects
+        self.combinations = combinations
+        self.renderer = schedule_renderer
+        # original position of each displayed combination, and their metrics (computed when first sorting)
+        self.order = range(len(combinations))
+        self.sorted_combinations = combinations
+        self.metrics = None
+        self.page = 0
+        self.page_count = max(1, -(-len(combinations) // GALLERY_PAGE_SIZE))
+        self.thumbnails = []
+
+        # page navigation
+        self.nav_frame = ctk.CTkFrame(self, fg_color='transparent')
+        self.nav_frame.grid(row=0, column=0, columnspan=GALLERY_COLUMNS, **padding)
+        self.prev_button = ctk.CTkButton(master=self.nav_frame, text='<', width=30,
+                                         command=lambda: self.show_page(self.page - 1), fg_color='purple')
+        self.prev_button.pack(side=ctk.LEFT, **padding)
+        self.page_label = ctk.CTkLabel(master=self.nav_frame, text='')
+        self.page_label.pack(side=ctk.LEFT, **padding)
+        self.next_button = ctk.CTkButton(master=self.nav_frame, text='>', width=30,
+                                         command=lambda: self.show_page(self.page + 1), fg_color='purple')
+        self.next_button.pack(side=ctk.LEFT, **padding)
+        self.sort_label = ctk.CTkLabel(master=self.nav_frame, text=SORT_TEXT)
+        self.sort_label.pack(side=ctk.LEFT, **padding)
+        self.sort_menu = ctk.CTkOptionMenu(master=self.nav_frame, values=list(SORT_OPTIONS), command=self.sort_action,
+                                           fg_color='purple', button_color='purple')
+        self.sort_menu.pack(side=ctk.LEFT, **padding)
+
+        self.show_page(0)
+
+    def sort_action(self, choice: str):
+        by, ascending = SORT_OPTIONS[choice]
+        if by is None:
+            self.order = range(len(self.combinations))
+        else:
+            if self.metrics is None:
+                self.metrics = metrics.metrics_table(self.combinations)
+            self.order = self.metrics.sort_values(by, ascending=ascending, kind='stable').index.tolist()
+        self.sorted_combinations = self.combinations.take(self.order)
+        self.show_page(0)
+
+    def show_page(self, page: int):
+        self.page = min(max(page, 0), self.page_count - 1)
+        self.page_label.configure(text=f"Página {self.page + 1} de {self.page_count}")
+        for thumbnail in self.thumbnails:
+            thumbnail.destroy()
+        self.thumbnails = []
+
+        first = self.page*GALLERY_PAGE_SIZE
+        page_combinations = self.sorted_combinations[first:first + GALLERY_PAGE_SIZE]
+        images = self.renderer.render(self.subjects, page_combinations, THUMBNAIL_SIZE)
+        for offset, image in enumerate(images):
+            # combinations keep their number, whichever the order
+            index = self.order[first + offset]
+            thumbnail = ctk.CTkButton(master=self,
+                                      text=f"Comb. {index + 1}",
+                                      image=ctk.CTkImage(light_image=image, dark_image=image, size=THUMBNAIL_SIZE),
+                                      compound='top',
+                                      fg_color='transparent',
+                                      text_color=('black', 'white'),
+                                      command=lambda i=index: self.open_schedule(i))
+            thumbnail.grid(row=1 + offset // GALLERY_COLUMNS, column=offset % GALLERY_COLUMNS, **padding)
+            self.thumbnails.append(thumbnail)
+
+    def open_schedule(self, index: int):
+        schedule = scheduler.Schedule(freq='60T')
+        schedule.add_combination(self.subjects, self.combinations[index])
+        window = ctk.CTkToplevel(self)
+        window.title(f"Comb. {index + 1}")
+        CTkSchedule(master=window, schedule=schedule).pack(expand=True, fill=ctk.BOTH, **padding)
+
 
 def main():
+    multiprocessing.freeze_support() # needed by the renderer's process pool in frozen executables
     root = MainWindow()
     root.mainloop()
 
@@ -0,0 +1,112 @@
+import os
+import re
+from typing import List, Dict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import combiner
+import scheduler
+import subject_parser
+
+
+class Catalogue(object):
+    """
+    A catalogue holds every subject requested by a cohort, each of them parsed only once,
+    along with the compatibility table of all their comissions
+    """
+    def __init__(self, subjects: Dict[str, combiner.Subject]):
+        self.subjects = subjects
+        self.table = combiner.CompatibilityTable(list(subjects.values()))
+
+    @classmethod
+    def from_urls(cls, urls: List[str], workers: int = 8):
+        """
+        Parses every distinct URL once (concurrently, since this is network bound).
+        Subjects are keyed by their URL
+        """
+        urls = list(dict.fromkeys(urls))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            subjects = list(executor.map(subject_parser.url_parse, urls))
+        return cls(dict(zip(urls, subjects)))
+
+
+class SelectionRequest(object):
+    """
+    A student's request: the subjects to combine (catalogue keys), optionally the chosen
+    comission ids of some of them (all comissions otherwise), and optional constraints
+    """
+    def __init__(self, student: str, subject_keys: List[str], comissions: Dict[str, List[str]] = None,
+                 constraints: combiner.Constraints = None):
+        self.student = student
+        self.subject_keys = subject_keys
+        self.comissions = comissions if comissions is not None else {}
+        self.constraints = constraints
+
+
+# catalogue of each worker process, sent only once when the worker starts
+_catalogue = None
+
+
+def _init_worker(catalogue: Catalogue):
+    global _catalogue
+    _catalogue = catalogue
+
+
+def _plan(request: SelectionRequest, output_dir: str, file_format: str) -> int:
+    """
+    Combines a single request against the worker's catalogue and writes its results
+    :return: the amount of combinations found
+    """
+    subjects = [_catalogue.subjects[key] for key in request.subject_keys]
+    selections = []
+    for key, subject in zip(request.subject_keys, subjects):
+        chosen = request.comissions.get(key)
+        if chosen is None:
+            selections.append(subject.comission_list)
+        else:
+            selections.append([com for com in subject.comission_list if com.identifyer in chosen])
+    combinations = _catalogue.table.find_combinations(subjects, selections, request.constraints)
+
+    filename = re.sub(r'[^\w\-]+', '_', request.student)
+    filepath = os.path.join(output_dir, f"{filename}.{file_format}")
+    if file_format == 'xlsx':
+        scheduler.save_to_excel(subjects, combinations, filepath)
+    elif file_format == 'html':
+        scheduler.save_to_html(subjects, combinations, filepath)
+    else:
+        scheduler.save_to_long_format(subjects, combinations, filepath, file_format)
+    return len(combinations)
+
+
+def plan_batch(catalogue: Catalogue, requests: List[SelectionRequest], output_dir: str,
+               file_format: str = 'csv', workers: int = None) -> Dict[str, int]:
+    """
+    Processes many selection requests against a single catalogue, in parallel,
+    writing the results of each student to <output_dir>/<student>.<file_format>
+    :param file_format: 'csv', 'parquet', 'html' or 'xlsx'
+    :param workers: amount of worker processes (defaults to the amount of CPUs), 1 to run serially
+    :return: dict mapping each student to the amount of combinations found
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    if workers == 1:
+        _init_worker(catalogue)
+        counts = [_plan(request, output_dir, file_format) for request in requests]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(catalogue,)) as executor:
+            counts = list(executor.map(_plan, requests,
+                                       [output_dir]*len(requests), [file_format]*len(requests)))
+    return {request.student: count for request, count in zip(requests, counts)}
+
+
+def test_batch():
+    """
+    the subjects from the combiner test are used as a catalogue for a few students
+    """
+    subjects, _ = combiner.test_combiner()
+    catalogue = Catalogue({subject.name: subject for subject in subjects})
+    requests = [SelectionRequest('alumno 1', [subjects[0].name, subjects[1].name]),
+                SelectionRequest('alumno 2', [subject.name for subject in subjects]),
+                SelectionRequest('alumno 3', [subjects[0].name, subjects[2].name], {subjects[0].name: ['A', 'B']})]
+    print(plan_batch(catalogue, requests, 'batch_outputs'))
+
+
+if __name__ == '__main__':
+    test_batch()
@@ -1,28 +1,118 @@
 from datetime import time
-from typing import List
+from typing import List, Dict, Tuple, Iterator, Callable
+from array import array
+from weakref import WeakValueDictionary
+import json
+import sys
+import math
+import random
+import warnings
 
 weekdays_list = ['LUNES', 'MARTES', 'MIERCOLES', 'JUEVES', 'VIERNES', 'SABADO']
+MINUTES_PER_DAY = 24*60
+
+
+def time_to_minutes(t: time) -> int:
+    """
+    :param t: time object
+    :return: minutes elapsed since midnight
+    """
+    return t.hour*60 + t.minute
+
+
+def occupancy_mask(weekday_index: int, start_minute: int, end_minute: int) -> int:
+    """
+    An occupancy mask is an int with one bit per minute of the week, where the bits set
+    are the minutes in the interval [start_minute, end_minute) of the given weekday.
+    Two intervals collide if and only if their masks share at least one bit
+    """
+    return ((1 << (end_minute - start_minute)) - 1) << (weekday_index*MINUTES_PER_DAY + start_minute)
+
+
+_weekday_indices = {weekday: index for index, weekday in enumerate(weekdays_list)}
+
+
+def weekday_index(weekday: str) -> int:
+    """
+    :param weekday: weekday name, in any case
+    :return: its index in weekdays_list
+    """
+    weekday = weekday.upper()
+    assert weekday in _weekday_indices, 'Invalid weekday'
+    return _weekday_indices[weekday]
 
 
 class CourseBlock(object):
     """
     A course block represents a grouping of a weekday and a time interval,
-    delimited by the start time and the end time
+    delimited by the start time and the end time. Internally, the weekday is stored
+    as its index in weekdays_list, and both times as minutes since midnight
     """
-    def __init__(self, weekday: str, start_time: time, end_time: time, teacher: str='', observation: str=''):
+    __slots__ = ('day', 'start', 'end', 'teacher', 'observation', '__weakref__')
+    # interned blocks, only as long as some comission still uses them
+    _shared = WeakValueDictionary()
+
+    def __init__(self, weekday: str | int, start_time: time | int, end_time: time | int,
+                 teacher: str='', observation: str=''):
+        if isinstance(weekday, str):
+            weekday = weekday_index(weekday)
+        assert 0 <= weekday < len(weekdays_list), 'Invalid weekday'
+        if isinstance(start_time, time):
+            start_time = time_to_minutes(start_time)
+        if isinstance(end_time, time):
+            end_time = time_to_minutes(end_time)
         for x in start_time, end_time:
-            assert isinstance(x, time), 'Invalid start or end time'
+            assert isinstance(x, int) and 0 <= x <= MINUTES_PER_DAY, 'Invalid start or end time'
         assert start_time < end_time, 'Start time should be smaller than endtime'
-        weekday = weekday.upper()
-        assert weekday in weekdays_list, 'Invalid weekday'
-        self.weekday = weekday
-        self.start_time = start_time
-        self.end_time = end_time
+        self.day = weekday
+        self.start = start_time
+        self.end = end_time
         self.teacher = teacher
         self.observation = observation
 
+    @classmethod
+    def shared(cls, weekday: str | int, start_time: time | int, end_time: time | int,
+               teacher: str='', observation: str=''):
+        """
+        Returns an interned course block, so that equal blocks (e.g. the same teórico
+        in many comissions) are validated once and share a single instance
+        """
+        if isinstance(weekday, str):
+            weekday = weekday_index(weekday)
+        if isinstance(start_time, time):
+            start_time = time_to_minutes(start_time)
+        if isinstance(end_time, time):
+            end_time = time_to_minutes(end_time)
+        key = (weekday, start_time, end_time, teacher, observation)
+        try:
+            return cls._shared[key]
+        except KeyError:
+            block = cls(weekday, start_time, end_time, teacher, observation)
+            cls._shared[key] = block
+            return block
+
+    @property
+    def occupancy(self) -> int:
+        # computed on demand, since a mask of the whole week is far bigger than the block itself
+        return occupancy_mask(self.day, self.start, self.end)
+
+    @property
+    def weekday(self) -> str:
+        return weekdays_list[self.day]
+
+    @property
+    def start_time(self) -> time:
+        return time(*divmod(self.start, 60))
+
+    @property
+    def end_time(self) -> time:
+        return time(*divmod(self.end, 60)) if self.end < MINUTES_PER_DAY else time.max
+
     def __eq__(self, other):
-        return self.weekday == other.weekday and self.start_time == other.start_time and self.end_time == other.end_time
+        return self.day == other.day and self.start == other.start and self.end == other.end
+
+    def __hash__(self):
+        return hash((self.day, self.start, self.end))
 
     def __str__(self):
         return f"{self.weekday}\n{self.start_time.isoformat(timespec='minutes')} - " \
@@ -31,16 +121,18 @@ class CourseBlock(object):
                 + f"\nObser.: {self.observation}"*int(bool(len(self.observation)))
 
     def collides_with(self, other):
-        if self.weekday != other.weekday:
-            return False
-        return other.start_time <= self.start_time < other.end_time \
-               or self.start_time <= other.start_time < self.end_time
+        return self.day == other.day and self.start < other.end and other.start < self.end
+
+    def day_mask(self):
+        return 1 << self.day
 
 
 class Comission(object):
     """
     A comission is a grouping of course blocks, with a unique identifier
     """
+    __slots__ = ('identifyer', 'block_list', '_sel', '_days')
+
     def __init__(self, identifyer: str | int, block_list: List[CourseBlock] = None):
         assert type(identifyer) == str, 'Invalid comission id'
         self.identifyer = identifyer
@@ -49,9 +141,38 @@ class Comission(object):
         else:
             self.block_list = block_list
         self._sel = True
+        self._days = None
 
     def add_course_block(self, c_block: CourseBlock):
         self.block_list.append(c_block)
+        # invalidate cached mask
+        self._days = None
+
+    @property
+    def occupancy(self) -> int:
+        """
+        Union of the occupancy masks of every course block. It is not cached, since
+        searches keep the masks they need only while they run
+        """
+        mask = 0
+        for block in self.block_list:
+            mask |= block.occupancy
+        return mask
+
+    @property
+    def days(self) -> int:
+        """
+        Bit mask of the weekdays this comission takes place in
+        """
+        if self._days is None:
+            self._days = 0
+            for block in self.block_list:
+                self._days |= block.day_mask()
+        return self._days
+
+    def has_teacher(self, teacher: str) -> bool:
+        teacher = teacher.strip().upper()
+        return any(teacher in str(block.teacher).upper() for block in self.block_list)
 
     def __str__(self):
         return f"Comision {self.identifyer}\n" + self.blocks_str()
@@ -60,11 +181,7 @@ class Comission(object):
         return '\n'.join([f"{str(block)}" for block in self.block_list])
 
     def collides_with(self, other):
-        for sblock in self.block_list:
-            for oblock in other.block_list:
-                if sblock.collides_with(oblock):
-                    return True
-        return False
+        return any(block.collides_with(other_block) for block in self.block_list for other_block in other.block_list)
 
     def select(self):
         self._sel = True
@@ -79,6 +196,8 @@ class Subject(object):
     """
     A subject has a name and a list of comissions
     """
+    __slots__ = ('name', 'comission_list')
+
     def __init__(self, name: str, comission_list: List[Comission] = None):
         self.name = name
         if comission_list is None:
@@ -101,6 +220,8 @@ class Combination(List[Comission]):
     """
     A combination is simply a list of comissionissions
     """
+    __slots__ = ()
+
     def is_valid(self):
         for i in range(len(self)):
             for j in range(i+1, len(self)):
@@ -110,39 +231,835 @@ class Combination(List[Comission]):
 
     def copy(self):
     # overrides copy to return a Combination object
-        new = Combination()
-        for el in self:
-            new.append(el)
-        return new
+        return Combination(self)
+
     def __str__(self):
         return '[' + ', '.join([str(comission.identifyer) for comission in self]) + ']'
 
+    def occupancy(self) -> int:
+        mask = 0
+        for comission in self:
+            mask |= comission.occupancy
+        return mask
+
+    def days(self) -> int:
+        mask = 0
+        for comission in self:
+            mask |= comission.days
+        return mask
+
 
-def find_combinations(subjects: List[Subject], current_combination=None, index: int = 0) -> List[Combination]:
+class CombinationSet(object):
+    """
+    A compact container of combinations: each combination is stored as a row of comission
+    indices (one per subject, into its comission_list) of a flat int16 array.
+    Combination objects are only built when accessed
+    """
+    __slots__ = ('subjects', 'indices', '_positions')
+    FILE_HEADER = b'PSICOMB1'
+
+    def __init__(self, subjects: List[Subject], indices: array = None):
+        self.subjects = list(subjects)
+        self.indices = array('h') if indices is None else indices
+        self._positions = None
+
+    def __len__(self):
+        return len(self.indices) // len(self.subjects) if len(self.subjects) else 0
+
+    def row(self, index: int) -> Tuple[int, ...]:
+        width = len(self.subjects)
+        return tuple(self.indices[index*width:(index + 1)*width])
+
+    def rows(self) -> Iterator[Tuple[int, ...]]:
+        width = len(self.subjects)
+        for start in range(0, len(self.indices), width):
+            yield tuple(self.indices[start:start + width])
+
+    def __getitem__(self, index: int | slice):
+        width = len(self.subjects)
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step == 1:
+                return CombinationSet(self.subjects, self.indices[start*width:stop*width])
+            return self.take(range(start, stop, step))
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('CombinationSet index out of range')
+        return Combination(subject.comission_list[position]
+                           for subject, position in zip(self.subjects, self.row(index)))
+
+    def __iter__(self) -> Iterator[Combination]:
+        for row in self.rows():
+            yield Combination(subject.comission_list[position] for subject, position in zip(self.subjects, row))
+
+    def append(self, combination: Combination):
+        if self._positions is None:
+            self._positions = [{comission: position for position, comission in enumerate(subject.comission_list)}
+                               for subject in self.subjects]
+        self.indices.extend(positions[comission] for positions, comission in zip(self._positions, combination))
+
+    def take(self, order) -> 'CombinationSet':
+        """
+        Returns a new set with the combinations at the given positions, in that order
+        """
+        width = len(self.subjects)
+        indices = array('h')
+        for index in order:
+            indices.extend(self.indices[index*width:(index + 1)*width])
+        return CombinationSet(self.subjects, indices)
+
+    def to_numpy(self):
+        """
+        :return: a (combinations x subjects) int16 NumPy view of the indices
+        """
+        import numpy as np
+        return np.frombuffer(self.indices, dtype=np.int16).reshape(len(self), len(self.subjects))
+
+    def save(self, filepath: str):
+        """
+        Saves the indices, along with the subject names and comission ids they refer to
+        """
+        header = json.dumps([[subject.name, [com.identifyer for com in subject.comission_list]]
+                             for subject in self.subjects]).encode('utf-8')
+        indices = self.indices
+        if sys.byteorder == 'big': # files are always little endian
+            indices = array('h', indices)
+            indices.byteswap()
+        with open(filepath, 'wb') as file:
+            file.write(self.FILE_HEADER)
+            file.write(len(header).to_bytes(4, 'little'))
+            file.write(header)
+            indices.tofile(file)
+
+    @classmethod
+    def load(cls, filepath: str, subjects: List[Subject]) -> 'CombinationSet':
+        """
+        Loads a set saved with save, checking that it refers to the given subjects
+        """
+        with open(filepath, 'rb') as file:
+            if file.read(len(cls.FILE_HEADER)) != cls.FILE_HEADER:
+                raise ValueError('Invalid combinations file')
+            header = json.loads(file.read(int.from_bytes(file.read(4), 'little')).decode('utf-8'))
+            indices = array('h', file.read())
+        if sys.byteorder == 'big':
+            indices.byteswap()
+        if header != [[subject.name, [com.identifyer for com in subject.comission_list]] for subject in subjects]:
+            raise ValueError('Saved combinations do not match the given subjects')
+        return cls(subjects, indices)
+
+
+class Constraints(object):
+    """
+    Hard constraints checked during the combination search: blocked time windows
+    (kept as a single occupancy mask), a maximum amount of days on campus,
+    and teacher filters
+    """
+    def __init__(self, max_days: int = None):
+        assert max_days is None or 0 < max_days <= len(weekdays_list), 'Invalid maximum amount of days'
+        self.max_days = max_days
+        self.blocked = 0
+        self.excluded_teachers = []
+        self.preferred_teachers = []
+
+    def block(self, weekday: str, start_time: time, end_time: time):
+        """
+        Forbids any class on the given weekday between start_time and end_time
+        """
+        assert start_time < end_time, 'Start time should be smaller than endtime'
+        self.blocked |= occupancy_mask(weekday_index(weekday),
+                                       time_to_minutes(start_time),
+                                       time_to_minutes(end_time))
+
+    def block_before(self, limit: time, weekdays: List[str] = None):
+        """
+        Forbids classes starting before limit (e.g. no classes before 10:00)
+        """
+        for weekday in weekdays or weekdays_list:
+            self.blocked |= occupancy_mask(weekday_index(weekday), 0, time_to_minutes(limit))
+
+    def block_after(self, limit: time, weekdays: List[str] = None):
+        """
+        Forbids classes ending after limit
+        """
+        for weekday in weekdays or weekdays_list:
+            self.blocked |= occupancy_mask(weekday_index(weekday), time_to_minutes(limit), MINUTES_PER_DAY)
+
+    def exclude_teacher(self, teacher: str):
+        """
+        Discards every comission with a course block given by this teacher
+        """
+        self.excluded_teachers.append(teacher)
+
+    def prefer_teacher(self, teacher: str):
+        """
+        For every subject with at least one comission given by this teacher,
+        only those comissions are kept. Other subjects are not affected
+        """
+        self.preferred_teachers.append(teacher)
+
+    def filter_comissions(self, comissions: List[Comission]) -> List[Comission]:
+        """
+        Applies the teacher filters and the blocked windows to a subject's candidate comissions
+        """
+        comissions = [com for com in comissions
+                      if not (self.blocked and com.occupancy & self.blocked)
+                      and not any(com.has_teacher(teacher) for teacher in self.excluded_teachers)]
+        for teacher in self.preferred_teachers:
+            preferred = [com for com in comissions if com.has_teacher(teacher)]
+            if len(preferred):
+                comissions = preferred
+        return comissions
+
+
+def find_combinations(subjects: List[Subject], current_combination=None, index: int = 0,
+                      constraints: Constraints = None) -> CombinationSet:
     """
     :param subjects: list of Subject objects
     :param current_combination: Combination object (defaults to newly created Combination object)
     :param index: index to the current subject at the subjects list
-    :return: comb_list, a list of all possible combinations
+    :param constraints: Constraints object, checked while searching (defaults to no constraints)
+    :return: comb_set, a CombinationSet with all possible combinations
     """
     if current_combination is None:
         current_combination = Combination()
-    comb_list = []
-    current_subject = subjects[index]
-
-    for comission in current_subject.get_selected_comissions():
-        # append to a copy of the ongoing combination in case the current comission collides with it
-        new_combination = current_combination.copy()
-        new_combination.append(comission)
-        if not new_combination.is_valid():
+    if constraints is None:
+        constraints = Constraints()
+    candidates = _search_candidates(subjects, constraints)
+    row = [subject.comission_list.index(comission) for subject, comission in zip(subjects, current_combination)]
+    comb_set = CombinationSet(subjects)
+    # blocked windows are just another occupied region of the week
+    occupancy = constraints.blocked | current_combination.occupancy()
+    _search(candidates, constraints.max_days, row, index, occupancy, current_combination.days(), comb_set)
+    return comb_set
+
+
+def _search_candidates(subjects: List[Subject], constraints: Constraints) -> List[List[Tuple[int, int, int]]]:
+    """
+    :return: for each subject, the (position, occupancy mask, weekday mask) of its candidate comissions.
+             Candidates keep their position in the subject's comission list, which is what gets stored
+    """
+    candidates = []
+    for subject in subjects:
+        allowed = set(constraints.filter_comissions(subject.get_selected_comissions()))
+        candidates.append([(position, comission.occupancy, comission.days)
+                           for position, comission in enumerate(subject.comission_list) if comission in allowed])
+    return candidates
+
+
+def _search(candidates: List[List[Tuple[int, int, int]]], max_days: int | None, row: List[int],
+            index: int, occupancy: int, days: int, comb_set: CombinationSet) -> None:
+    """
+    Recursive step of find_combinations, carrying the occupancy and weekday masks
+    of the ongoing combination so that every check is a single bitwise operation
+    """
+    for position, comission_occupancy, comission_days in candidates[index]:
+        if comission_occupancy & occupancy:
+            continue
+        new_days = days | comission_days
+        if max_days is not None and new_days.bit_count() > max_days:
             continue
-        if index == len(subjects) - 1: # if the recursion reached the last subject, save the combination
-            comb_list.append(new_combination)
+        row.append(position)
+        if index == len(candidates) - 1: # if the recursion reached the last subject, save the combination
+            comb_set.indices.extend(row)
         else: # move on to the next subject
-            new_comb_list = find_combinations(subjects, new_combination, index+1)
-            comb_list = comb_list + new_comb_list
+            _search(candidates, max_days, row, index+1, occupancy | comission_occupancy, new_days, comb_set)
+        row.pop()
+
+
+def find_subset_combinations(subjects: List[Subject], min_k: int, max_k: int = None,
+                             constraints: Constraints = None) -> Dict[Tuple[Subject, ...], CombinationSet]:
+    """
+    Finds the combinations of every subset of k subjects, with min_k <= k <= max_k, in a single search
+    :param subjects: list of n candidate Subject objects
+    :param min_k: minimum amount of subjects to take
+    :param max_k: maximum amount of subjects to take (defaults to min_k, i.e. exactly k subjects)
+    :param constraints: Constraints object, checked while searching (defaults to no constraints)
+    :return: dict mapping each feasible subset (as a tuple of subjects, in their original order)
+             to the CombinationSet of its combinations
+    """
+    if max_k is None:
+        max_k = min_k
+    assert 0 < min_k <= max_k <= len(subjects), 'Invalid amount of subjects'
+    if constraints is None:
+        constraints = Constraints()
+    candidates = _search_candidates(subjects, constraints)
+
+    # future_masks[i] covers every minute some candidate from subject i onwards could use,
+    # so two partial selections whose occupancies agree on it share the same completions
+    future_masks = [0]*(len(candidates) + 1)
+    for index in range(len(candidates) - 1, -1, -1):
+        future_masks[index] = future_masks[index + 1]
+        for _, comission_occupancy, _ in candidates[index]:
+            future_masks[index] |= comission_occupancy
+
+    root = _subset_search(candidates, future_masks, constraints.max_days, 0,
+                          constraints.blocked, 0, min_k, max_k, {})
+    subset_dict = {}
+    if root is not None:
+        _expand_subset_node(root, [], [], subjects, subset_dict)
+    return {tuple(comb_set.subjects): comb_set for comb_set in subset_dict.values()}
+
+
+def _subset_search(candidates: List[List[Tuple[int, int, int]]], future_masks: List[int], max_days: int | None, index: int,
+                   occupancy: int, days: int, min_left: int, max_left: int, memo: dict) -> tuple | None:
+    """
+    Recursive step of find_subset_combinations. Each subject is either taken (with any compatible
+    comission) or skipped. Instead of lists of combinations, it builds a graph of partial results:
+    a node is (index, [(comission position, child node), ...], skip node), () marks a complete selection
+    and None a dead end. Nodes are memoized by search state, so overlapping subsets share them
+    """
+    if max_left == 0 or index == len(candidates):
+        return () if min_left <= 0 else None
+    if len(candidates) - index < min_left: # not enough subjects left to reach min_k
+        return None
+
+    key = (index, occupancy & future_masks[index], days if max_days is not None else 0, min_left, max_left)
+    if key in memo:
+        return memo[key]
+
+    takes = []
+    for position, comission_occupancy, comission_days in candidates[index]:
+        if comission_occupancy & occupancy:
+            continue
+        new_days = days | comission_days
+        if max_days is not None and new_days.bit_count() > max_days:
+            continue
+        child = _subset_search(candidates, future_masks, max_days, index+1,
+                               occupancy | comission_occupancy, new_days, min_left-1, max_left-1, memo)
+        if child is not None:
+            takes.append((position, child))
+    skip = _subset_search(candidates, future_masks, max_days, index+1,
+                          occupancy, days, min_left, max_left, memo)
+
+    node = (index, takes, skip) if len(takes) or skip is not None else None
+    memo[key] = node
+    return node
+
+
+def _expand_subset_node(node: tuple, subject_indices: List[int], row: List[int], subjects: List[Subject],
+                        subset_dict: Dict[Tuple[int, ...], CombinationSet]) -> None:
+    """
+    Walks the graph built by _subset_search, saving every complete selection under its subset
+    """
+    if node == ():
+        key = tuple(subject_indices)
+        if key not in subset_dict:
+            subset_dict[key] = CombinationSet([subjects[i] for i in key])
+        subset_dict[key].indices.extend(row)
+        return
+    index, takes, skip = node
+    subject_indices.append(index)
+    for position, child in takes:
+        row.append(position)
+        _expand_subset_node(child, subject_indices, row, subjects, subset_dict)
+        row.pop()
+    subject_indices.pop()
+    if skip is not None:
+        _expand_subset_node(skip, subject_indices, row, subjects, subset_dict)
+
+
+class CompatibilityTable(object):
+    """
+    Pairwise compatibility of every comission of a list of subjects, computed only once.
+    Comissions are numbered in subject order, and each one holds a bit mask of the comissions
+    (from other subjects) it can coexist with, so that the search carries the set of comissions
+    still compatible with the ongoing combination and prunes as soon as a subject runs out of them
+    """
+    def __init__(self, subjects: List[Subject]):
+        self.subjects = list(subjects)
+        self.comissions = []
+        self._subject_bits = {} # subject -> mask of all of its comissions
+        self._comission_bits = {} # comission -> its own bit
+        self._offsets = {} # subject -> index of its first comission
+        for subject in self.subjects:
+            first = len(self.comissions)
+            self.comissions.extend(subject.comission_list)
+            self._subject_bits[subject] = ((1 << len(subject.comission_list)) - 1) << first
+            self._offsets[subject] = first
+        for index, comission in enumerate(self.comissions):
+            self._comission_bits[comission] = 1 << index
+
+        self.compatible = [0]*len(self.comissions)
+        occupancies = [comission.occupancy for comission in self.comissions]
+        for i, occupancy in enumerate(occupancies):
+            for j in range(i+1, len(occupancies)):
+                if not occupancy & occupancies[j]:
+                    self.compatible[i] |= 1 << j
+                    self.compatible[j] |= 1 << i
+        # comissions of the same subject never coexist
+        for subject in self.subjects:
+            subject_bits = self._subject_bits[subject]
+            for comission in subject.comission_list:
+                self.compatible[self.comission_index(comission)] &= ~subject_bits
+
+    def comission_index(self, comission: Comission) -> int:
+        return self._comission_bits[comission].bit_length() - 1
+
+    def subject_mask(self, subject: Subject) -> int:
+        return self._subject_bits[subject]
+
+    def candidate_masks(self, subjects: List[Subject], selections: List[List[Comission]] = None,
+                        constraints: Constraints = None) -> List[int]:
+        """
+        :param subjects: list of Subject objects, all of them in the table
+        :param selections: candidate comissions of each subject (defaults to the selected ones)
+        :param constraints: Constraints object (defaults to no constraints)
+        :return: for each subject, the bit mask of its candidate comissions
+        """
+        if selections is None:
+            selections = [subject.get_selected_comissions() for subject in subjects]
+        if constraints is None:
+            constraints = Constraints()
+        masks = []
+        for selection in selections:
+            mask = 0
+            for comission in constraints.filter_comissions(selection):
+                mask |= self._comission_bits[comission]
+            masks.append(mask)
+        return masks
+
+    def find_combinations(self, subjects: List[Subject], selections: List[List[Comission]] = None,
+                          constraints: Constraints = None) -> CombinationSet:
+        """
+        Same results as find_combinations, but searching over the precomputed compatibility masks
+        :param subjects: list of Subject objects, all of them in the table
+        :param selections: candidate comissions of each subject (defaults to the selected ones)
+        :param constraints: Constraints object (defaults to no constraints)
+        :return: comb_set, a CombinationSet with all possible combinations
+        """
+        if constraints is None:
+            constraints = Constraints()
+        candidates = self.candidate_masks(subjects, selections, constraints)
+        offsets = [self._offsets[subject] for subject in subjects]
+        comb_set = CombinationSet(subjects)
+        if all(candidates):
+            self._search(candidates, offsets, constraints.max_days, 0, (1 << len(self.comissions)) - 1, 0,
+                         [], comb_set)
+        return comb_set
+
+    def _search(self, candidates: List[int], offsets: List[int], max_days: int | None, index: int, allowed: int,
+                days: int, row: List[int], comb_set: CombinationSet) -> None:
+        mask = candidates[index] & allowed
+        while mask:
+            low_bit = mask & -mask
+            mask ^= low_bit
+            comission_index = low_bit.bit_length() - 1
+            new_days = days | self.comissions[comission_index].days
+            if max_days is not None and new_days.bit_count() > max_days:
+                continue
+            row.append(comission_index - offsets[index])
+            if index == len(candidates) - 1:
+                comb_set.indices.extend(row)
+            else:
+                new_allowed = allowed & self.compatible[comission_index]
+                # forward check: every subject left must still have some compatible candidate
+                if all(candidate & new_allowed for candidate in candidates[index+1:]):
+                    self._search(candidates, offsets, max_days, index+1, new_allowed, new_days, row, comb_set)
+            row.pop()
+
+
+    def count_combinations(self, subjects: List[Subject], selections: List[List[Comission]] = None,
+                           constraints: Constraints = None) -> int:
+        """
+        Counts the combinations without enumerating them, by dynamic programming over the
+        search states (see _count)
+        """
+        if constraints is None:
+            constraints = Constraints()
+        candidates = self.candidate_masks(subjects, selections, constraints)
+        return self._count(candidates, _later_masks(candidates), constraints.max_days, 0,
+                           (1 << len(self.comissions)) - 1, 0, {})
+
+    def _count(self, candidates: List[int], later: List[int], max_days: int | None,
+               index: int, allowed: int, days: int, memo: dict) -> int:
+        """
+        Amount of ways to complete a combination from subject index onwards. It only depends on
+        which later candidates are still allowed (and on the weekdays used, if they are limited),
+        so it is memoized by that state
+        """
+        if index == len(candidates):
+            return 1
+        key = (index, allowed & later[index], days if max_days is not None else 0)
+        if key in memo:
+            return memo[key]
+        count = 0
+        mask = candidates[index] & allowed
+        while mask:
+            low_bit = mask & -mask
+            mask ^= low_bit
+            comission_index = low_bit.bit_length() - 1
+            new_days = days | self.comissions[comission_index].days
+            if max_days is not None and new_days.bit_count() > max_days:
+                continue
+            count += self._count(candidates, later, max_days, index+1,
+                                 allowed & self.compatible[comission_index], new_days, memo)
+        memo[key] = count
+        return count
+
+    def _count_relaxations(self, candidates: List[int], extras: List[int], later: List[int], max_days: int | None,
+                           index: int, allowed: int, days: int, memo: dict, exact_memo: dict) -> Dict[tuple | None, int]:
+        """
+        Same as _count, but allowing at most one relaxation along the way: either dropping
+        a subject, ('drop', subject index), or enabling one of its extra comissions,
+        ('enable', comission index)
+        :return: dict mapping each relaxation (None for no relaxation at all) to the amount of
+                 combinations it restores
+        """
+        if index == len(candidates):
+            return {None: 1}
+        key = (index, allowed & later[index], days if max_days is not None else 0)
+        if key in memo:
+            return memo[key]
+        counts = {}
+        mask = candidates[index] & allowed
+        while mask:
+            low_bit = mask & -mask
+            mask ^= low_bit
+            comission_index = low_bit.bit_length() - 1
+            new_days = days | self.comissions[comission_index].days
+            if max_days is not None and new_days.bit_count() > max_days:
+                continue
+            for relaxation, count in self._count_relaxations(candidates, extras, later, max_days, index+1,
+                                                             allowed & self.compatible[comission_index],
+                                                             new_days, memo, exact_memo).items():
+                counts[relaxation] = counts.get(relaxation, 0) + count
+
+        # relaxations only take exact completions from here on
+        count = self._count(candidates, later, max_days, index+1, allowed, days, exact_memo)
+        if count:
+            counts[('drop', index)] = count
+        mask = extras[index] & allowed
+        while mask:
+            low_bit = mask & -mask
+            mask ^= low_bit
+            comission_index = low_bit.bit_length() - 1
+            new_days = days | self.comissions[comission_index].days
+            if max_days is not None and new_days.bit_count() > max_days:
+                continue
+            count = self._count(candidates, later, max_days, index+1,
+                                allowed & self.compatible[comission_index], new_days, exact_memo)
+            if count:
+                counts[('enable', comission_index)] = count
+
+        memo[key] = counts
+        return counts
+
+
+def _later_masks(candidates: List[int]) -> List[int]:
+    """
+    later[i] is the union of the candidate masks of subjects i onwards
+    """
+    later = [0]*(len(candidates) + 1)
+    for index in range(len(candidates) - 1, -1, -1):
+        later[index] = later[index + 1] | candidates[index]
+    return later
+
+
+class Relaxation(object):
+    """
+    A single change to the user's choice, along with the amount of combinations it restores:
+    either dropping a subject (comission is None) or enabling one more of its comissions
+    """
+    def __init__(self, subject: Subject, comission: Comission | None, count: int):
+        self.subject = subject
+        self.comission = comission
+        self.count = count
+
+    def __str__(self):
+        if self.comission is None:
+            return f"Quitar {self.subject.name}: {self.count} combinaciones"
+        return f"Habilitar comision {self.comission.identifyer} de {self.subject.name}: {self.count} combinaciones"
+
+
+class Diagnosis(object):
+    """
+    Explains why a choice of subjects and comissions has no valid combination
+    """
+    def __init__(self, empty_subjects: List[Subject], conflicts: List[Tuple[Subject, Subject]],
+                 minimal_conflict: List[Subject], relaxations: List[Relaxation],
+                 infeasible_subjects: List[Subject] = None):
+        # subjects with no candidate comission left (none selected, or all of them discarded by constraints)
+        self.empty_subjects = empty_subjects
+        # subjects with candidates, none of which fits the constraints even alone (e.g. too many days)
+        self.infeasible_subjects = infeasible_subjects if infeasible_subjects is not None else []
+        # edges of the conflict graph: pairs of subjects whose candidates are pairwise incompatible
+        self.conflicts = conflicts
+        # a minimal set of subjects that cannot coexist
+        self.minimal_conflict = minimal_conflict
+        # single relaxations that restore combinations, the best ones first
+        self.relaxations = relaxations
+
+    def __str__(self):
+        lines = [f"Sin comisiones: {subject.name}" for subject in self.empty_subjects]
+        lines += [f"Ninguna comision cumple las restricciones: {subject.name}" for subject in self.infeasible_subjects]
+        lines += [f"Incompatibles: {first.name} y {second.name}" for first, second in self.conflicts]
+        if len(self.minimal_conflict) and not len(lines):
+            lines.append('Incompatibles: ' + ', '.join(subject.name for subject in self.minimal_conflict))
+        lines += [str(relaxation) for relaxation in self.relaxations[:3]]
+        return '\n'.join(lines)
+
+
+def diagnose(subjects: List[Subject], constraints: Constraints = None, table: CompatibilityTable = None) -> Diagnosis:
+    """
+    Diagnoses a choice without valid combinations, using only the pairwise compatibility data
+    :param subjects: list of Subject objects
+    :param constraints: Constraints object (defaults to no constraints)
+    :param table: CompatibilityTable holding the subjects (built if not given)
+    :return: Diagnosis object
+    """
+    if constraints is None:
+        constraints = Constraints()
+    if table is None:
+        table = CompatibilityTable(subjects)
+    candidates = table.candidate_masks(subjects, None, constraints)
+    everything = (1 << len(table.comissions)) - 1
+
+    empty_subjects = [subject for subject, candidate in zip(subjects, candidates) if not candidate]
+    # with a maximum amount of days, a subject may have candidates and still be infeasible on its own
+    if constraints.max_days is None:
+        infeasible_subjects = []
+    else:
+        infeasible_subjects = [subject for subject, candidate in zip(subjects, candidates) if candidate
+                               and not table._count([candidate], _later_masks([candidate]), constraints.max_days,
+                                                    0, everything, 0, {})]
+
+    # conflict graph
+    conflicts = []
+    for i in range(len(subjects)):
+        for j in range(i+1, len(subjects)):
+            if not candidates[i] or not candidates[j]:
+                continue
+            mask = candidates[i]
+            compatible = False
+            while mask and not compatible:
+                low_bit = mask & -mask
+                mask ^= low_bit
+                compatible = bool(table.compatible[low_bit.bit_length() - 1] & candidates[j])
+            if not compatible:
+                conflicts.append((subjects[i], subjects[j]))
+
+    # minimal conflict: a subject infeasible on its own, a conflicting pair (every subject being feasible
+    # on its own by then), or else shrink the whole set by dropping every subject that is not needed
+    # for the conflict to persist
+    if len(empty_subjects) or len(infeasible_subjects):
+        minimal_conflict = (empty_subjects + infeasible_subjects)[:1]
+    elif len(conflicts):
+        minimal_conflict = list(conflicts[0])
+    elif table._count(candidates, _later_masks(candidates), constraints.max_days, 0, everything, 0, {}):
+        minimal_conflict = []
+    else:
+        kept = list(range(len(subjects)))
+        for index in list(kept):
+            rest = [candidates[i] for i in kept if i != index]
+            if not table._count(rest, _later_masks(rest), constraints.max_days, 0, everything, 0, {}):
+                kept.remove(index)
+        minimal_conflict = [subjects[i] for i in kept]
+
+    # relaxations, counted in a single memoized pass. Only deselected comissions can be enabled,
+    # and only if the constraints would keep them once selected
+    extras = []
+    for subject in subjects:
+        selected = subject.get_selected_comissions()
+        enabled = [comission for comission in subject.comission_list if not comission.is_selected()
+                   and comission in constraints.filter_comissions(selected + [comission])]
+        extras.append(table.candidate_masks([subject], [enabled])[0])
+    later = [mask | extra for mask, extra in zip(_later_masks(candidates), _later_masks(extras))]
+    counts = table._count_relaxations(candidates, extras, later, constraints.max_days, 0, everything, 0, {}, {})
+    relaxations = []
+    for relaxation, count in counts.items():
+        if relaxation is None:
+            continue
+        kind, index = relaxation
+        if kind == 'drop':
+            relaxations.append(Relaxation(subjects[index], None, count))
+        else:
+            comission = table.comissions[index]
+            subject = next(subject for subject in subjects if table.subject_mask(subject) >> index & 1)
+            relaxations.append(Relaxation(subject, comission, count))
+    relaxations.sort(key=lambda relaxation: relaxation.count, reverse=True)
+
+    return Diagnosis(empty_subjects, conflicts, minimal_conflict, relaxations, infeasible_subjects)
+
+
+def sample_combinations(subjects: List[Subject], n: int, seed: int = None, constraints: Constraints = None,
+                        table: CompatibilityTable = None) -> CombinationSet:
+    """
+    Draws n distinct valid combinations uniformly at random, without enumerating them all.
+    Each draw walks the subjects in order, picking every comission with probability proportional
+    to the amount of combinations completing it, as counted by CompatibilityTable._count
+    :param subjects: list of Subject objects
+    :param n: amount of combinations to draw (all of them are returned if there are no more than n)
+    :param seed: random seed, for reproducible samples
+    :param constraints: Constraints object (defaults to no constraints)
+    :param table: CompatibilityTable holding the subjects (built if not given)
+    :return: comb_set, a CombinationSet with the sample, in enumeration order
+    """
+    if constraints is None:
+        constraints = Constraints()
+    if table is None:
+        table = CompatibilityTable(subjects)
+    candidates = table.candidate_masks(subjects, None, constraints)
+    later = _later_masks(candidates)
+    offsets = [table._offsets[subject] for subject in subjects]
+    everything = (1 << len(table.comissions)) - 1
+    memo = {}
+    total = table._count(candidates, later, constraints.max_days, 0, everything, 0, memo)
+    rng = random.Random(seed)
+
+    if n >= total:
+        return table.find_combinations(subjects, None, constraints)
+    if 2*n > total:
+        # drawing would mostly hit repeated combinations, so pick among all of them instead
+        comb_set = table.find_combinations(subjects, None, constraints)
+        return comb_set.take(sorted(rng.sample(range(total), n)))
+
+    rows = set()
+    while len(rows) < n:
+        row = []
+        allowed, days = everything, 0
+        for index in range(len(candidates)):
+            # pick the comission whose completions contain the drawn one
+            target = rng.randrange(table._count(candidates, later, constraints.max_days, index, allowed, days, memo))
+            mask = candidates[index] & allowed
+            while mask:
+                low_bit = mask & -mask
+                mask ^= low_bit
+                comission_index = low_bit.bit_length() - 1
+                new_days = days | table.comissions[comission_index].days
+                if constraints.max_days is not None and new_days.bit_count() > constraints.max_days:
+                    continue
+                new_allowed = allowed & table.compatible[comission_index]
+                count = table._count(candidates, later, constraints.max_days, index+1, new_allowed, new_days, memo)
+                if target < count:
+                    break
+                target -= count
+            row.append(comission_index - offsets[index])
+            allowed, days = new_allowed, new_days
+        rows.add(tuple(row))
+
+    comb_set = CombinationSet(subjects)
+    for row in sorted(rows):
+        comb_set.indices.extend(row)
+    return comb_set
+
+
+# An engine takes the subjects, the constraints and optionally a CompatibilityTable holding the subjects
+# (which engines may reuse instead of building their own), and returns the CombinationSet of every valid combination
+Engine = Callable[[List[Subject], Constraints, CompatibilityTable | None], CombinationSet]
+ENGINES: Dict[str, Engine] = {}
+REFERENCE_ENGINE = 'recursive'
+
+
+def register_engine(name: str, engine: Engine) -> None:
+    ENGINES[name] = engine
+
+
+register_engine('recursive', lambda subjects, constraints, table=None:
+                find_combinations(subjects, constraints=constraints))
+register_engine('compatibility', lambda subjects, constraints, table=None:
+                (table or CompatibilityTable(subjects)).find_combinations(subjects, constraints=constraints))
+
+
+class ProblemStats(object):
+    """
+    Cheap statistics of a search problem, used to choose an engine
+    """
+    # comissions sampled per subject to estimate the conflict density
+    SAMPLE_SIZE = 4
+
+    def __init__(self, subjects: List[Subject], constraints: Constraints):
+        candidates = [constraints.filter_comissions(subject.get_selected_comissions()) for subject in subjects]
+        self.subject_count = len(subjects)
+        self.comissions_per_subject = sum(map(len, candidates)) / max(1, len(candidates))
+        self.search_space = math.prod(map(len, candidates))
+
+        # fraction of colliding comission pairs, among a few of each pair of subjects
+        pairs = collisions = 0
+        for i in range(len(candidates)):
+            for j in range(i+1, len(candidates)):
+                for first in candidates[i][:self.SAMPLE_SIZE]:
+                    for second in candidates[j][:self.SAMPLE_SIZE]:
+                        pairs += 1
+                        collisions += bool(first.occupancy & second.occupancy)
+        self.conflict_density = collisions / pairs if pairs else 0.0
+
+
+def choose_engine(stats: ProblemStats) -> str:
+    """
+    The recursive search has no setup cost, so it is best for tiny problems. Otherwise the
+    compatibility table pays off, the more so the more subjects and conflicts there are
+    """
+    if stats.subject_count <= 2 or stats.search_space <= 1000:
+        return 'recursive'
+    if stats.subject_count >= 4 or stats.conflict_density >= 0.2:
+        return 'compatibility'
+    return 'recursive'
+
+
+class EngineReport(object):
+    """
+    Differences between the results of an engine and those of the reference engine,
+    with combinations given as tuples of comission ids
+    """
+    def __init__(self, engine: str, reference: CombinationSet, results: CombinationSet):
+        def id_rows(comb_set: CombinationSet) -> List[Tuple[str, ...]]:
+            return [tuple(comission.identifyer for comission in combination) for combination in comb_set]
+        reference_rows = id_rows(reference)
+        rows = id_rows(results)
+        self.engine = engine
+        self.reference_count = len(reference_rows)
+        self.count = len(rows)
+        self.missing = sorted(set(reference_rows) - set(rows))
+        self.extra = sorted(set(rows) - set(reference_rows))
+        self.duplicates = len(rows) - len(set(rows))
+
+    def ok(self) -> bool:
+        return not len(self.missing) and not len(self.extra) and not self.duplicates
+
+    def __str__(self):
+        return f"Engine {self.engine}: {self.count} combinations ({self.reference_count} expected), " \
+               f"{len(self.missing)} missing, {len(self.extra)} extra, {self.duplicates} duplicated"
+
+
+def verify_engine(engine: str, subjects: List[Subject], constraints: Constraints = None,
+                  table: CompatibilityTable = None) -> EngineReport:
+    """
+    Runs an engine and the reference engine on the same input, and reports any difference
+    """
+    if constraints is None:
+        constraints = Constraints()
+    return EngineReport(engine,
+                        ENGINES[REFERENCE_ENGINE](subjects, constraints, table),
+                        ENGINES[engine](subjects, constraints, table))
+
+
+def combine(subjects: List[Subject], constraints: Constraints = None, engine: str = 'auto',
+            verify: bool = False, table: CompatibilityTable = None) -> CombinationSet:
+    """
+    Finds every valid combination with the given engine
+    :param subjects: list of Subject objects
+    :param constraints: Constraints object (defaults to no constraints)
+    :param engine: name of a registered engine, or 'auto' to choose one from the problem statistics
+    :param verify: if True, the engine's results are checked against the reference engine.
+                   On any difference a warning is issued and the reference results are returned
+    :param table: CompatibilityTable holding the subjects, reused by the engines that need one
+    :return: comb_set, a CombinationSet with all possible combinations
+    """
+    if constraints is None:
+        constraints = Constraints()
+    if engine == 'auto':
+        engine = choose_engine(ProblemStats(subjects, constraints))
+    if not verify or engine == REFERENCE_ENGINE:
+        return ENGINES[engine](subjects, constraints, table)
 
-    return comb_list
+    reference = ENGINES[REFERENCE_ENGINE](subjects, constraints, table)
+    results = ENGINES[engine](subjects, constraints, table)
+    report = EngineReport(engine, reference, results)
+    if not report.ok():
+        warnings.warn(str(report))
+        return reference
+    return results
 
 
 def test_combiner():
@@ -0,0 +1,123 @@
+import math
+from typing import List
+import numpy as np
+import pandas as pd
+import combiner
+
+# combinations processed at once, to bound the size of the occupancy arrays
+CHUNK_SIZE = 20_000
+METRIC_COLUMNS = ['days', 'idle_minutes', 'earliest_start', 'latest_finish', 'hours', 'hours_per_day', 'max_day_hours']
+
+
+class SlotGrid(object):
+    """
+    Time slots every combination of some subjects can be drawn on: the slot length is the gcd
+    of all block boundaries, so that every block covers a whole amount of slots,
+    and they span from the earliest start to the latest finish of any block
+    """
+    def __init__(self, subjects: List[combiner.Subject]):
+        blocks = [block for subject in subjects for comission in subject.comission_list for block in comission.block_list]
+        bounds = [minute for block in blocks for minute in (block.start, block.end)]
+        self.slot = math.gcd(*bounds) or 60
+        self.first = min(bounds, default=0)
+        self.slot_count = max(1, (max(bounds, default=0) - self.first) // self.slot)
+
+        # per subject, a (comissions x weekdays x slots) occupancy array of each comission
+        self.occupancy = []
+        for subject in subjects:
+            array = np.zeros((len(subject.comission_list), len(combiner.weekdays_list), self.slot_count), dtype=bool)
+            for position, comission in enumerate(subject.comission_list):
+                for block in comission.block_list:
+                    array[position, block.day, self.slot_index(block.start):self.slot_index(block.end)] = True
+            self.occupancy.append(array)
+
+    def slot_index(self, minute: int) -> int:
+        return (minute - self.first) // self.slot
+
+    def combine(self, rows: np.ndarray) -> np.ndarray:
+        """
+        :param rows: (combinations x subjects) array of comission positions
+        :return: (combinations x weekdays x slots) occupancy array of those combinations
+        """
+        occupancy = self.occupancy[0][rows[:, 0]]
+        for column in range(1, rows.shape[1]):
+            occupancy |= self.occupancy[column][rows[:, column]]
+        return occupancy
+
+
+def _chunk_metrics(grid: SlotGrid, occupancy: np.ndarray) -> dict:
+    busy = occupancy.sum(axis=2)
+    has_classes = busy > 0
+    first = occupancy.argmax(axis=2)
+    last = grid.slot_count - occupancy[:, :, ::-1].argmax(axis=2)
+    span = np.where(has_classes, last - first, 0)
+    days = has_classes.sum(axis=1)
+    hours = busy.sum(axis=1)*grid.slot/60
+    return {'days': days,
+            'idle_minutes': (span - busy).sum(axis=1)*grid.slot,
+            'earliest_start': grid.first + np.where(has_classes, first, grid.slot_count).min(axis=1)*grid.slot,
+            'latest_finish': grid.first + np.where(has_classes, last, 0).max(axis=1)*grid.slot,
+            'hours': hours,
+            'hours_per_day': hours/np.maximum(days, 1),
+            'max_day_hours': busy.max(axis=1)*grid.slot/60}
+
+
+def metrics_table(combinations: combiner.CombinationSet, chunk_size: int = CHUNK_SIZE) -> pd.DataFrame:
+    """
+    Computes, for every combination at once, the values they are usually sorted and filtered by.
+    Its index matches the positions in combinations, so that combinations.take(table.index) follows the table
+    :return: DataFrame with one row per combination, and columns
+             days: amount of days on campus
+             idle_minutes: minutes between classes, added over all days
+             earliest_start, latest_finish: earliest and latest minute of the week with classes
+             hours, hours_per_day, max_day_hours: hours of classes in the week, per day on campus and on the busiest day
+    """
+    if not len(combinations):
+        return pd.DataFrame({column: [] for column in METRIC_COLUMNS})
+    grid = SlotGrid(combinations.subjects)
+    rows = combinations.to_numpy()
+    chunks = [_chunk_metrics(grid, grid.combine(rows[start:start + chunk_size]))
+              for start in range(0, len(rows), chunk_size)]
+    return pd.DataFrame({column: np.concatenate([chunk[column] for chunk in chunks]) for column in METRIC_COLUMNS})
+
+
+def sort_combinations(combinations: combiner.CombinationSet, table: pd.DataFrame, by: str | List[str],
+                      ascending: bool | List[bool] = True) -> combiner.CombinationSet:
+    """
+    Sorts combinations by some columns of their metrics table, keeping the enumeration order among ties
+    """
+    order = table.sort_values(by, ascending=ascending, kind='stable').index
+    return combinations.take(order)
+
+
+def filter_combinations(combinations: combiner.CombinationSet, table: pd.DataFrame,
+                        max_days: int = None, max_idle_minutes: int = None,
+                        not_before: int = None, not_after: int = None) -> combiner.CombinationSet:
+    """
+    Keeps the combinations whose metrics are within the given limits (times in minutes)
+    """
+    mask = pd.Series(True, index=table.index)
+    if max_days is not None:
+        mask &= table['days'] <= max_days
+    if max_idle_minutes is not None:
+        mask &= table['idle_minutes'] <= max_idle_minutes
+    if not_before is not None:
+        mask &= table['earliest_start'] >= not_before
+    if not_after is not None:
+        mask &= table['latest_finish'] <= not_after
+    return combinations.take(table.index[mask])
+
+
+def test_metrics():
+    """
+    shows the metrics of the combinations generated by the combiner test, sorted by days and idle time
+    """
+    subjects, combinations = combiner.test_combiner()
+    table = metrics_table(combinations)
+    print(table.sort_values(['days', 'idle_minutes'], kind='stable'))
+    for combination in sort_combinations(combinations, table, ['days', 'idle_minutes'])[:3]:
+        print(combination)
+
+
+if __name__ == '__main__':
+    test_metrics()
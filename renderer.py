@@ -0,0 +1,160 @@
+import hashlib
+from collections import OrderedDict
+from typing import List, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, ImageDraw, ImageFont
+import combiner
+
+# same time range as scheduler.Schedule
+FIRST_MINUTE = 7*60
+LAST_MINUTE = 23*60
+HEADER_COLOR = 'lightgreen'
+STRIPE_COLORS = ('white', '#eeeeee')
+# batches smaller than this are rendered in this process: a thumbnail takes ~2 ms to draw,
+# about as long as shipping it back from a worker, so only big exports are worth the pool
+MIN_POOL_BATCH = 500
+# rendered images kept in memory (~80 KB each as 180x150 thumbnails)
+CACHE_SIZE = 10*24
+
+# a spec is the list of (weekday index, start minute, end minute, label, color) to draw
+Spec = List[Tuple[int, int, int, str, str]]
+
+
+def combination_spec(subjects: List[combiner.Subject], combination: combiner.Combination) -> Spec:
+    """
+    Blocks to draw for a combination, with the same labels and colors as a Schedule
+    """
+    # imported here, so that pool workers (which only draw) do not import pandas
+    import scheduler
+    spec = []
+    for subject, comission in zip(subjects, combination):
+        label = f"{subject.name} {comission.identifyer}"
+        color = scheduler.Schedule.get_color(label)
+        for block in comission.block_list:
+            spec.append((block.day, block.start, block.end, label, color))
+    return spec
+
+
+def render_spec(spec: Spec, size: Tuple[int, int]) -> Image.Image:
+    """
+    Draws a weekly schedule straight to a PIL image of the given size
+    """
+    width, height = size
+    image = Image.new('RGB', size, 'white')
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.load_default()
+    header = max(10, height // 14)
+    left = max(12, width // 12)
+    col_width = (width - left) / len(combiner.weekdays_list)
+    scale = (height - header) / (LAST_MINUTE - FIRST_MINUTE)
+
+    # hour stripes and labels
+    for hour, minute in enumerate(range(FIRST_MINUTE, LAST_MINUTE, 60)):
+        top = header + (minute - FIRST_MINUTE)*scale
+        draw.rectangle((0, top, width, top + 60*scale), fill=STRIPE_COLORS[hour % 2])
+        if 60*scale >= 10:
+            draw.text((1, top), f"{minute // 60:02d}", fill='black', font=font)
+
+    # weekday headers
+    draw.rectangle((0, 0, width, header), fill=HEADER_COLOR)
+    for day, weekday in enumerate(combiner.weekdays_list):
+        draw.text((left + day*col_width + 2, 0), weekday[:2] if col_width < 60 else weekday, fill='black', font=font)
+
+    # course blocks
+    for day, start, end, label, color in spec:
+        x0 = left + day*col_width + 1
+        x1 = left + (day + 1)*col_width - 1
+        y0 = header + (max(start, FIRST_MINUTE) - FIRST_MINUTE)*scale
+        y1 = header + (min(end, LAST_MINUTE) - FIRST_MINUTE)*scale
+        draw.rectangle((x0, y0, x1, y1), fill=color, outline='grey')
+        if y1 - y0 >= 12 and x1 - x0 >= 20:
+            # clip the label to the block width
+            while len(label) and draw.textlength(label, font=font) > x1 - x0 - 4:
+                label = label[:-1]
+            draw.text((x0 + 2, y0 + 1), label, fill='white', font=font)
+
+    return image
+
+
+def _render_bytes(spec: Spec, size: Tuple[int, int]) -> bytes:
+    # worker side: images travel back to the main process as raw RGB bytes
+    return render_spec(spec, size).tobytes()
+
+
+class ScheduleRenderer(object):
+    """
+    Renders combinations to images, keeping the most recently used ones by a hash
+    of the combination's occupancy, labels, colors and the image size.
+    Batches of at least MIN_POOL_BATCH images are rendered across a process pool. This is opt-in
+    for bulk renders: the GUI only renders gallery pages, which are always drawn in this process
+    """
+    def __init__(self, workers: int = None, cache_size: int = CACHE_SIZE):
+        self.workers = workers
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self._executor = None
+
+    @staticmethod
+    def cache_key(combination: combiner.Combination, spec: Spec, size: Tuple[int, int]) -> str:
+        labels = sorted({(label, color) for _, _, _, label, color in spec})
+        key = f"{combination.occupancy():x}|{labels}|{size}"
+        return hashlib.blake2b(key.encode('utf-8'), digest_size=16).hexdigest()
+
+    def render(self, subjects: List[combiner.Subject], combinations, size: Tuple[int, int]) -> List[Image.Image]:
+        """
+        :param subjects: list of Subject objects
+        :param combinations: iterable of Combination objects (e.g. a CombinationSet)
+        :param size: (width, height) of each image
+        :return: one image per combination
+        """
+        keys = []
+        images = {}
+        missing = {}
+        for combination in combinations:
+            spec = combination_spec(subjects, combination)
+            key = self.cache_key(combination, spec, size)
+            keys.append(key)
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                images[key] = self.cache[key]
+            else:
+                missing[key] = spec
+
+        if len(missing) < MIN_POOL_BATCH:
+            for key, spec in missing.items():
+                images[key] = render_spec(spec, size)
+        else:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            rendered = self._executor.map(_render_bytes, missing.values(), [size]*len(missing))
+            for key, data in zip(missing.keys(), rendered):
+                images[key] = Image.frombytes('RGB', size, data)
+
+        # only the last images are kept, which for the gallery means the last pages seen
+        for key in keys[-self.cache_size:]:
+            self.cache[key] = images[key]
+            self.cache.move_to_end(key)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+        return [images[key] for key in keys]
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+
+def test_renderer():
+    """
+    renders the combinations generated by the combiner test
+    """
+    subjects, combinations = combiner.test_combiner()
+    renderer = ScheduleRenderer()
+    images = renderer.render(subjects, combinations, (480, 400))
+    renderer.close()
+    images[0].save('combination.png')
+
+
+if __name__ == '__main__':
+    test_renderer()
@@ -1,25 +1,41 @@
 import pandas as pd
 import combiner
-from typing import List
+from typing import List, Iterable, Iterator, Callable
 import matplotlib.colors as mcolors
 import random
+import json
+import csv
+import hashlib
+import itertools
+import threading
 
 class Schedule(pd.DataFrame):
     # generate this time series only once, since it's shared by all instances
     color_dict = {}
     colors_list = list(mcolors.TABLEAU_COLORS.values())
+    # colors are assigned from both the GUI thread and the Excel export thread
+    color_lock = threading.Lock()
     def __init__(self, freq : str='15T'):
         time_series = pd.date_range(start='07:00', end='23:00', freq=freq).time
         super().__init__('', index=time_series, columns= list(combiner.weekdays_list))
 
     def add_course_block(self, course_block: combiner.CourseBlock, repr_str: str) -> None:
         self.loc[course_block.start_time : course_block.end_time, course_block.weekday].iloc[:-1] = repr_str
-        if repr_str not in self.color_dict.keys():
-            if len(self.colors_list) == 0: # reset colors if we run out of them
-                self.colors_list = list(mcolors.TABLEAU_COLORS.values())
-            chosen_color = random.choice(self.colors_list)
-            self.colors_list.remove(chosen_color)
-            self.color_dict[repr_str] = chosen_color
+        self.get_color(repr_str)
+
+    @classmethod
+    def get_color(cls, repr_str: str) -> str:
+        """
+        Returns the color assigned to a comission label, choosing a new one if it has none yet
+        """
+        with cls.color_lock:
+            if repr_str not in cls.color_dict.keys():
+                if len(cls.colors_list) == 0: # reset colors if we run out of them
+                    cls.colors_list = list(mcolors.TABLEAU_COLORS.values())
+                chosen_color = random.choice(cls.colors_list)
+                cls.colors_list.remove(chosen_color)
+                cls.color_dict[repr_str] = chosen_color
+            return cls.color_dict[repr_str]
 
     def add_combination(self, subjects: List[combiner.Subject], combination: combiner.Combination) -> None:
         for subject, comission in zip(subjects, combination):
@@ -37,9 +53,11 @@ class Schedule(pd.DataFrame):
 
 
 
-def save_to_excel(subjects: List[combiner.Subject], combinations: List[combiner.Combination], filepath: str):
+def save_to_excel(subjects: List[combiner.Subject], combinations: List[combiner.Combination], filepath: str,
+                  progress: Callable[[int, int], None] = None):
     """
     This function saves a list of combinations to a single Excel file
+    :param progress: optional callback, called as progress(done, total) after every sheet
     """
 
     with pd.ExcelWriter(filepath) as writer:
@@ -58,6 +76,208 @@ def save_to_excel(subjects: List[combiner.Subject], combinations: List[combiner.
                 column_width = max(copy_df[column].astype(str).map(len).max(), len(column))
                 col_idx = df.columns.get_loc(column) + 1
                 writer.sheets[f"Combination {index + 1}"].set_column(col_idx, col_idx, column_width)
+            if progress is not None:
+                progress(index + 1, len(combinations))
+
+
+HTML_TEMPLATE = """<!DOCTYPE html>
+<html lang="es">
+<head>
+<meta charset="utf-8">
+<title>PsiComb</title>
+<style>
+body { font-family: helvetica, arial, sans-serif; margin: 20px; }
+#nav { display: flex; gap: 10px; align-items: center; margin-bottom: 15px; }
+#nav button { background: purple; color: white; border: none; border-radius: 10px; padding: 5px 15px; cursor: pointer; }
+#nav input { width: 70px; }
+#grid { display: grid; grid-template-columns: 50px repeat(var(--days), 1fr); gap: 2px; }
+.header { background: lightgreen; font-weight: bold; text-align: center; padding: 4px; }
+.column { position: relative; background: repeating-linear-gradient(#fff 0 var(--hour), #eee var(--hour) calc(2 * var(--hour))); }
+.hour { height: var(--hour); font-size: 11px; text-align: right; padding-right: 4px; box-sizing: border-box; }
+.block { position: absolute; left: 1px; right: 1px; overflow: hidden; border: 1px solid grey; border-radius: 4px;
+         font-size: 11px; color: white; padding: 2px; box-sizing: border-box; }
+#legend { margin-top: 15px; font-size: 13px; }
+</style>
+</head>
+<body>
+<div id="nav">
+<button id="prev">&lt;</button>
+<span>Combinación <input id="page" type="number" min="1" value="1"> de <span id="total"></span></span>
+<button id="next">&gt;</button>
+</div>
+<div id="grid"></div>
+<div id="legend"></div>
+<script id="data" type="application/json">/*DATA*/</script>
+<script>
+const data = JSON.parse(document.getElementById("data").textContent);
+const first = 7 * 60, last = 23 * 60, hour = 40;
+const grid = document.getElementById("grid"), legend = document.getElementById("legend");
+const page = document.getElementById("page");
+const pad = n => String(n).padStart(2, "0");
+const fmt = m => pad(Math.floor(m / 60)) + ":" + pad(m % 60);
+grid.style.setProperty("--days", data.weekdays.length);
+grid.style.setProperty("--hour", hour + "px");
+document.getElementById("total").textContent = data.combinations.length;
+page.max = data.combinations.length;
+
+function render(index) {
+  // schedules are only drawn when the user pages to them
+  grid.innerHTML = "<div></div>" + data.weekdays.map(d => `<div class="header">${d}</div>`).join("");
+  const hours = document.createElement("div");
+  for (let m = first; m < last; m += 60) hours.innerHTML += `<div class="hour">${fmt(m)}</div>`;
+  grid.appendChild(hours);
+  const columns = data.weekdays.map(() => grid.appendChild(document.createElement("div")));
+  columns.forEach(c => { c.className = "column"; c.style.height = (last - first) / 60 * hour + "px"; });
+  legend.innerHTML = "";
+  (data.combinations[index] || []).forEach((c, s) => {
+    const subject = data.subjects[s], comission = subject.comissions[c];
+    for (const [day, start, end, teacher, observation] of comission.blocks) {
+      const block = document.createElement("div");
+      block.className = "block";
+      block.style.top = (start - first) / 60 * hour + "px";
+      block.style.height = (end - start) / 60 * hour + "px";
+      block.style.background = comission.color;
+      block.title = `${comission.label}\\n${fmt(start)} - ${fmt(end)}\\nProf.: ${teacher}` + (observation ? `\\nObser.: ${observation}` : "");
+      block.textContent = comission.label;
+      columns[day].appendChild(block);
+    }
+    const item = legend.appendChild(document.createElement("div"));
+    item.innerHTML = `<span style="color:${comission.color}">&#9632;</span> `;
+    item.appendChild(document.createTextNode(comission.label));
+  });
+}
+
+function go(n) {
+  n = Math.min(Math.max(n, 1), data.combinations.length);
+  page.value = n;
+  render(n - 1);
+}
+document.getElementById("prev").onclick = () => go(Number(page.value) - 1);
+document.getElementById("next").onclick = () => go(Number(page.value) + 1);
+page.onchange = () => go(Number(page.value));
+go(1);
+</script>
+</body>
+</html>
+"""
+
+
+def save_to_html(subjects: List[combiner.Subject], combinations: List[combiner.Combination], filepath: str):
+    """
+    This function saves a list of combinations to a single, self-contained HTML report.
+    Subjects are written once, and each combination only as the indices of its comissions,
+    so that the browser draws a schedule only when the user pages to it
+    """
+    if isinstance(combinations, combiner.CombinationSet):
+        comb_rows = [list(row) for row in combinations.rows()]
+    else:
+        com_indices = [{id(comission): index for index, comission in enumerate(subject.comission_list)}
+                       for subject in subjects]
+        comb_rows = [[indices[id(comission)] for indices, comission in zip(com_indices, combination)]
+                     for combination in combinations]
+
+    # only comissions present in some combination get a color, as in the Excel file
+    used = [set() for _ in subjects]
+    for row in comb_rows:
+        for subject_used, index in zip(used, row):
+            subject_used.add(index)
+
+    subjects_data = []
+    for subject, subject_used in zip(subjects, used):
+        comissions_data = []
+        for index, comission in enumerate(subject.comission_list):
+            label = f"{subject.name} {comission.identifyer}"
+            comissions_data.append({'label': label,
+                                    'color': Schedule.get_color(label) if index in subject_used else 'grey',
+                                    'blocks': [[block.day, block.start, block.end,
+                                                str(block.teacher), str(block.observation)]
+                                               for block in comission.block_list]})
+        subjects_data.append({'name': subject.name, 'comissions': comissions_data})
+
+    data = json.dumps({'weekdays': combiner.weekdays_list,
+                       'subjects': subjects_data,
+                       'combinations': comb_rows},
+                      ensure_ascii=False, separators=(',', ':'))
+    # avoid closing the script tag from within the data
+    data = data.replace('</', '<\\/')
+    with open(filepath, 'w', encoding='utf-8') as file:
+        file.write(HTML_TEMPLATE.replace('/*DATA*/', data))
+
+
+LONG_FORMAT_COLUMNS = ['combination_id', 'subject', 'comission', 'weekday', 'start', 'end', 'teacher', 'observation']
+
+
+def combination_id(subjects: List[combiner.Subject], combination: combiner.Combination) -> str:
+    """
+    Stable identifier of a combination: a short hash of its subject names and comission ids,
+    so that the same combination gets the same id across runs and students
+    """
+    key = '\x1f'.join(f"{subject.name}\x1e{comission.identifyer}" for subject, comission in zip(subjects, combination))
+    return hashlib.blake2b(key.encode('utf-8'), digest_size=8).hexdigest()
+
+
+def iter_long_rows(subjects: List[combiner.Subject], combinations: Iterable[combiner.Combination]) -> Iterator[tuple]:
+    """
+    Yields one row per (combination, subject, comission, course block), in LONG_FORMAT_COLUMNS order.
+    Weekdays are indices in combiner.weekdays_list, start and end are minutes since midnight
+    """
+    block_rows = {} # rows of each comission, computed only once
+    for combination in combinations:
+        comb_id = combination_id(subjects, combination)
+        for subject, comission in zip(subjects, combination):
+            try:
+                rows = block_rows[id(comission)]
+            except KeyError:
+                rows = [(subject.name, comission.identifyer, block.day, block.start, block.end,
+                         str(block.teacher), str(block.observation))
+                        for block in comission.block_list]
+                block_rows[id(comission)] = rows
+            for row in rows:
+                yield (comb_id,) + row
+
+
+def save_to_long_format(subjects: List[combiner.Subject], combinations: Iterable[combiner.Combination],
+                        filepath: str, file_format: str = None, chunk_size: int = 100_000):
+    """
+    This function saves combinations in long format (see iter_long_rows) to a CSV or Parquet file.
+    Rows are written in chunks straight from the combinations iterator, so memory stays bounded
+    :param file_format: 'csv' or 'parquet' (defaults to the file extension)
+    :param chunk_size: amount of rows held in memory before writing them
+    """
+    if file_format is None:
+        file_format = filepath.rsplit('.', 1)[-1]
+    file_format = file_format.lower()
+    rows = iter_long_rows(subjects, combinations)
+
+    if file_format == 'csv':
+        with open(filepath, 'w', newline='', encoding='utf-8') as file:
+            writer = csv.writer(file)
+            writer.writerow(LONG_FORMAT_COLUMNS)
+            while True:
+                chunk = list(itertools.islice(rows, chunk_size))
+                if not len(chunk):
+                    break
+                writer.writerows(chunk)
+
+    elif file_format == 'parquet':
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError('pyarrow is required to export to Parquet')
+        schema = pa.schema([('combination_id', pa.string()), ('subject', pa.string()), ('comission', pa.string()),
+                            ('weekday', pa.int8()), ('start', pa.int16()), ('end', pa.int16()),
+                            ('teacher', pa.string()), ('observation', pa.string())])
+        with pq.ParquetWriter(filepath, schema) as writer:
+            while True:
+                chunk = list(itertools.islice(rows, chunk_size))
+                if not len(chunk):
+                    break
+                columns = [list(column) for column in zip(*chunk)]
+                writer.write_table(pa.Table.from_arrays(columns, schema=schema))
+
+    else:
+        raise ValueError(f'Invalid file format: {file_format}')
 
 
 def test_scheduler():
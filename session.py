@@ -0,0 +1,105 @@
+import json
+import os
+from typing import List, Tuple
+import combiner
+
+
+def subject_to_dict(subject: combiner.Subject) -> dict:
+    """
+    Plain representation of a subject, with weekdays as indices and times as minutes
+    """
+    return {'name': subject.name,
+            'comissions': [{'id': comission.identifyer,
+                            'blocks': [[block.day, block.start, block.end, str(block.teacher), str(block.observation)]
+                                       for block in comission.block_list]}
+                           for comission in subject.comission_list]}
+
+
+def subject_from_dict(subject_dict: dict) -> combiner.Subject:
+    """
+    Inverse of subject_to_dict
+    """
+    subject = combiner.Subject(subject_dict['name'])
+    for comission_dict in subject_dict['comissions']:
+        comission = combiner.Comission(comission_dict['id'])
+        for day, start, end, teacher, observation in comission_dict['blocks']:
+            comission.add_course_block(combiner.CourseBlock.shared(day, start, end, teacher, observation))
+        subject.append_comission(comission)
+    return subject
+
+
+class SessionStore(object):
+    """
+    Saves the chosen subjects, their comission selections and optionally the last results
+    to local files, so that a session can be resumed without network access nor searching.
+    Each subject is serialized only once, so that saving after a toggle only encodes the selections.
+    Results are only kept until the next save without them, since that means the choice changed
+    """
+    def __init__(self, path: str, results_path: str = None):
+        self.path = path
+        self.results_path = results_path
+        self._fragments = {} # subject -> its JSON fragment
+
+    def save(self, subjects: List[combiner.Subject], combinations: combiner.CombinationSet = None, total: int = None):
+        """
+        :param subjects: current list of Subject objects
+        :param combinations: results of a search for exactly this choice, None if the choice changed since
+        :param total: amount of combinations found, when combinations is only a sample of them
+        """
+        fragments = []
+        for subject in subjects:
+            if subject not in self._fragments:
+                self._fragments[subject] = json.dumps(subject_to_dict(subject), ensure_ascii=False, separators=(',', ':'))
+            fragments.append(self._fragments[subject])
+        # forget deleted subjects
+        self._fragments = {subject: self._fragments[subject] for subject in subjects}
+        selected = [[int(comission.is_selected()) for comission in subject.comission_list] for subject in subjects]
+
+        content = '{"subjects":[' + ','.join(fragments) + '],"selected":' + json.dumps(selected, separators=(',', ':'))
+        if self.results_path is not None:
+            if combinations is not None:
+                combinations.save(self.results_path)
+                if total is not None:
+                    content += f',"total":{total}'
+            elif os.path.exists(self.results_path):
+                # the previous results do not match the new choice anymore
+                os.remove(self.results_path)
+        self._write(self.path, content + '}')
+
+    @staticmethod
+    def _write(path: str, content: str):
+        # write to a temporary file first, so that a crash never leaves a half written session
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            file.write(content)
+        os.replace(temp_path, path)
+
+    def load(self) -> Tuple[List[combiner.Subject], combiner.CombinationSet | None, int | None]:
+        """
+        :return: the saved subjects (empty if there is no session), the last results,
+                 or None if there are none matching those subjects, and the amount of combinations
+                 found if the results are only a sample of them (None otherwise)
+        """
+        try:
+            with open(self.path, encoding='utf-8') as file:
+                session_dict = json.load(file)
+        except (OSError, ValueError):
+            return [], None, None
+
+        subjects = []
+        for subject_dict, selected in zip(session_dict['subjects'], session_dict['selected']):
+            subject = subject_from_dict(subject_dict)
+            for comission, is_selected in zip(subject.comission_list, selected):
+                if not is_selected:
+                    comission.deselect()
+            subjects.append(subject)
+            self._fragments[subject] = json.dumps(subject_dict, ensure_ascii=False, separators=(',', ':'))
+
+        combinations = None
+        if self.results_path is not None and len(subjects):
+            try:
+                combinations = combiner.CombinationSet.load(self.results_path, subjects)
+            except (OSError, ValueError):
+                pass
+        total = session_dict.get('total') if combinations is not None else None
+        return subjects, combinations, total
@@ -1,7 +1,6 @@
 import pandas as pd
 from typing import Tuple
 import os
-from datetime import time
 import combiner
 import re
 from typing import List
@@ -11,14 +10,12 @@ pd.set_option('display.width', 400)
 pd.set_option("display.max_columns", 10)
 
 ROMAN_CONSTANTS = ("I", "II", "III", "IV", "V", "VI", "VII", "VIII", "IX", "XI", "XII", "XII", "XIV", "XV" )
-
-def is_roman_number(num: str):
-    """
-    checks whether a str is a (small) roman numeral
-    """
-    pattern = re.compile(r"^(X{0,3})(IX|IV|V?I{0,3})$", re.VERBOSE)
-    return bool(re.match(pattern, num))
-
+# small roman numerals, which are the keys of teóricos
+ROMAN_PATTERN = re.compile(r"^(X{0,3})(IX|IV|V?I{0,3})$")
+# hh and mm are the first and last two characters of a time string, as in str_to_time_tuple
+TIME_REGEX = r"^(\d{2}).*?(\d{2})$"
+EMPTY_OBSERVATIONS = ['nan', '', '.', '-']
+WEEKDAY_INDICES = {weekday: index for index, weekday in enumerate(combiner.weekdays_list)}
 
 def str_to_time_tuple(time_str: str) -> Tuple[int, int]:
     """
@@ -38,28 +35,50 @@ def str_to_time_tuple(time_str: str) -> Tuple[int, int]:
     return hh, mm
 
 
+def parse_minutes(column: pd.Series) -> pd.Series:
+    """
+    Vectorized version of str_to_time_tuple, returning minutes since midnight
+    """
+    parts = column.astype(str).str.strip().str.extract(TIME_REGEX)
+    hours = pd.to_numeric(parts[0])
+    minutes = pd.to_numeric(parts[1])
+    invalid = hours.isna() | minutes.isna() | (hours >= 24) | (minutes >= 60)
+    if invalid.any():
+        bad_rows = ', '.join(f"{index} ({value!r})" for index, value in column[invalid].items())
+        raise ValueError(f"Invalid {column.name} time in rows: {bad_rows}")
+    return (hours*60 + minutes).astype(int)
+
+
 def parse_course_blocks(df: pd.DataFrame) -> dict:
     """
     Get course blocks from a website-like dataframe
     """
+    identifyers = df.iloc[:, 0].astype(str).str.strip().str.upper()
+
+    # weekdays, dropping accents (e.g. MIÉRCOLES)
+    weekdays = df['Dia'].astype(str).str.strip().str.upper() \
+        .str.normalize('NFKD').str.encode('ascii', 'ignore').str.decode('ascii')
+    days = weekdays.map(WEEKDAY_INDICES)
+    if days.isna().any():
+        bad_rows = ', '.join(f"{index} ({value!r})" for index, value in df['Dia'][days.isna()].items())
+        raise ValueError(f"Invalid weekday in rows: {bad_rows}")
+
+    starts = parse_minutes(df['Inicio'])
+    ends = parse_minutes(df['Fin'])
+    if (starts >= ends).any():
+        bad_rows = ', '.join(str(index) for index in df.index[starts >= ends])
+        raise ValueError(f"Start time should be smaller than end time in rows: {bad_rows}")
+
+    # discard empty observations, and break the others in lines
+    observations = df['Observ.'].astype(str)
+    observations = observations.where(~observations.str.strip().isin(EMPTY_OBSERVATIONS), '') \
+        .str.replace(r'[.\-]', '\n', regex=True)
 
     cb_dict = {}
-    for index, row in df.iterrows():
-        weekday = row['Dia'].strip()
-        start_time_str = row['Inicio']
-        start_time = time(*str_to_time_tuple(start_time_str))
-        end_time_str = row['Fin']
-        end_time = time(*str_to_time_tuple(end_time_str))
-        identifyer = str(row.iloc[0]).strip().upper()
-        teacher = row['Profesor']
-        observation = row['Observ.']
-        if str(observation).strip() in ['nan', ' ', '.', '-']:
-            # discard empty observations
-            observation = ''
-        else:
-            observation = '\n'.join(re.split(r'[.\-]', observation))
-        new_cb = combiner.CourseBlock(weekday, start_time, end_time, teacher, observation)
-        cb_dict[identifyer] = new_cb
+    for identifyer, day, start, end, teacher, observation in zip(identifyers, days.astype(int).tolist(),
+                                                                   starts.tolist(), ends.tolist(),
+                                                                   df['Profesor'].tolist(), observations):
+        cb_dict[identifyer] = combiner.CourseBlock.shared(day, start, end, teacher, observation)
 
     return cb_dict
 
@@ -79,23 +98,26 @@ def dfs_to_subject(name: str, teo_df: pd.DataFrame, com_df: pd.DataFrame, sem_df
         sem_cb_dict = {}
     com_dict = parse_course_blocks(com_df)
 
+    # split the obligatory keys of every comission at once: roman numerals are teóricos,
+    # and the rest, if any, seminaries
+    com_df = com_df.reset_index(drop=True)
+    keys = com_df['Oblig.'].astype(str).str.strip().str.split(' - ').explode().str.strip()
+    is_teo = keys.str.fullmatch(ROMAN_PATTERN)
+    teo_keys = keys[is_teo].groupby(level=0).agg(list).reindex(com_df.index)
+    sem_keys = keys[~is_teo].groupby(level=0).agg(list).reindex(com_df.index)
+
     # build actual comissions
-    for index, row in com_df.iterrows():
-        identifyer = str(row['Comisiones']).strip()
+    identifyers = com_df['Comisiones'].astype(str).str.strip()
+    for identifyer, row_teo_keys, row_sem_keys in zip(identifyers, teo_keys, sem_keys):
         new_com = combiner.Comission(identifyer)
 
         # add course blocks
-        keys = [x.strip() for x in row['Oblig.'].strip().split(' - ')]
-        teo_keys = [key for key in keys if is_roman_number(key)]
-        for teo_key in teo_keys:
-            teo_cb = teo_cb_dict[teo_key]
-            new_com.add_course_block(teo_cb)
-            keys.remove(teo_key)
-        if sem_df is not None:
-            # the only keys left, if any, are seminary keys
-            for sem_key in keys:
-                sem_cb = sem_cb_dict[sem_key]
-                new_com.add_course_block(sem_cb)
+        if isinstance(row_teo_keys, list):
+            for teo_key in row_teo_keys:
+                new_com.add_course_block(teo_cb_dict[teo_key])
+        if sem_df is not None and isinstance(row_sem_keys, list):
+            for sem_key in row_sem_keys:
+                new_com.add_course_block(sem_cb_dict[sem_key])
 
         com_cb = com_dict[identifyer]
         new_com.add_course_block(com_cb)